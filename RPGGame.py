@@ -1,7 +1,42 @@
 import zmq                  # as communication pipe
+import io
 import json
-import os
+import threading
 import time
+from contextlib import contextmanager
+from asset_cache import AssetCache
+import save_format
+import metrics
+from world import WORLD_FILE, START_ZONE, DIRECTION_SLOTS, Player, build_world, compile_world, load_snapshot, \
+    source_fingerprint, validate_world
+from pathfinding import load_graph
+from regions import PAGED_ZONE_COUNT, REGION_BUDGET, RegionTable, load_regions, write_regions
+
+# Microservice addresses
+IMAGE_ADDRESS = "tcp://localhost:5555"
+SAVE_ADDRESS = "tcp://localhost:5556"
+THEME_ADDRESS = "tcp://localhost:5557"
+CHARACTER_ADDRESS = "tcp://localhost:5558"
+
+# Milliseconds to wait for a reply, retries after a timeout, and seconds before the first retry (doubling each time)
+REQUEST_TIMEOUT = 3000
+REQUEST_RETRIES = 2
+RETRY_BACKOFF = 0.25
+
+# Theme streaming: bytes per chunk, chunk requests kept in flight, and milliseconds to wait for a chunk
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_CREDIT = 8
+STREAM_TIMEOUT = 5000
+
+# Defaults for the prefetch settings: how many moves ahead to fetch zone assets, and the cache size
+PREFETCH_DEPTH = 1
+PREFETCH_BUDGET_MB = 32
+PREFETCH_BATCH = 4              # Assets requested together by the prefetcher
+PROMPT_ASSET_TIMEOUT = 500      # Milliseconds the prompt waits, without retrying, for an asset not prefetched
+
+# Default seconds between autosaves while there are unsaved changes (0 turns autosave off), and their slot
+AUTOSAVE_INTERVAL = 30
+AUTOSAVE_SLOT = "autosave"
 
 error_command = "Sorry I could not understand that command. Please try another command.\n"
 
@@ -10,13 +45,14 @@ def comm_err():
     print(error_command)
 
 
-def exit_game():
+def exit_game(on_exit=None):
     while True:
-        check = input("Are you sure you want to exit the game? "
-                      "Please remember to save your character manually. (Y/N) ").lower().strip()
+        check = input("Are you sure you want to exit the game? (Y/N) ").lower().strip()
         if check == "n":
             return
         if check == "y":
+            if on_exit is not None:
+                on_exit()
             print("Thank you for playing!")
             exit()
         else:
@@ -28,8 +64,14 @@ class Help:
         self._message = "At any time, you can use the command 'help' to show available global commands.\n"
         self._commands = {
             "help": "Show available global commands",
-            "exit": "Exits the game. Your progress will not be saved",
-            "character": "Manage your character (change name, view status, add experience, level up, save)"
+            "exit": "Exits the game. Unsaved progress is autosaved unless autosave is off",
+            "character": "Manage your character (change name, view status, add experience, level up, save)",
+            "save": "Save your game under a name of your choice",
+            "load": "Load one of your saves",
+            "saves": "List, delete and copy your saves",
+            "travel <zone>": "Walk the shortest route to a zone you name",
+            "stats [image|save|theme|character]": "Show request timings of the game, or of a service",
+            "profile on|off": "Start or stop profiling the game's requests and tracing its memory, shown by stats"
         }
 
     def message(self):
@@ -117,14 +159,52 @@ class Game:
             "King Victor is in distress, his people are dying and if this curse is not cleansed soon \n"
             "the kingdom may be entirely wiped out. You heard his call, promising the title of Lord and land to \n"
             "any adventurer that may cure the land of the curse.\n")
-        self.zones = {}
+        self.world = None
+        self._world_path = None     # File the world was loaded from, to cache its path tables beside
+        self._graph = None
+        self.zones = {}         # Zones by id
         self.quests = {}
         self.npcs = {}
+        self._objects = {}      # Quests and NPCs by object_num
+        self._changed = {}      # object_num -> saveable state as loaded, for objects changed since
         self._settings = {}
         self.menu = StartMenu()
         self.adventurer = Player()
         self._help = Help()
         self._zeromq = ZeroPipe()
+        self._theme_stream = None
+        self._prefetcher = AssetPrefetcher(PREFETCH_BUDGET_MB * 1024 * 1024)
+        self._state_lock = threading.RLock()      # Held while saveable state changes or is exported
+        self._autosaver = Autosaver(self)
+
+    @contextmanager
+    def changing(self):
+        """
+        Wraps changes to saveable state so the autosaver neither exports them
+        half made nor misses them
+        """
+        with self._state_lock:
+            yield
+        self._autosaver.mark_dirty()
+
+    def autosave_interval(self):
+        return self._settings.get("autosave_interval", AUTOSAVE_INTERVAL)
+
+    def snapshot(self):
+        """
+        Returns the player's name and their save data, consistent with each other
+        """
+        with self._state_lock:
+            return self.adventurer.name, self.export_game_data()
+
+    def shutdown(self):
+        """
+        Writes the last autosave and releases the character session before the game exits
+        """
+        if self.autosave_interval() > 0:
+            print("Saving your progress...")
+        self._autosaver.stop()
+        close_character_session()
 
     def start_menu(self):
         """
@@ -132,81 +212,120 @@ class Game:
         """
         self.menu.start_options()
 
-    def load_map_data(self, data=None):
-        if data is None:
-            try:
-                with open('game_data.json', 'r') as infile:
-                    data = json.load(infile)
-            except FileNotFoundError:  # Error handling
-                print(f'Could not find file game_data.json')
-
-        print('Loading map data')
-        for i in range(len(data["zone_data"])):
-            zone = Zone(data["zone_data"][i])
-            name = data["zone_data"][i]["zone_name"]
-            self.zones[name] = zone
-        print('Loading map data completed')
-
-    def load_quest_data(self, data=None):
-        if data is None:
-            try:
-                with open('game_data.json', 'r') as infile:
-                    data = json.load(infile)
-            except FileNotFoundError:  # Error handling
-                print(f'Could not find file game_data.json')
-
-        print('Loading quest data')
-        for i in range(len(data["quest_data"])):
-            quest = Quest(data["quest_data"][i])
-            name = data["quest_data"][i]["quest_name"]
-            self.quests[name] = quest
-        print('Loading quest data completed')
-
-    def load_npc_data(self, data=None):
-        if data is None:
-            try:
-                with open('game_data.json', 'r') as infile:
-                    data = json.load(infile)
-            except FileNotFoundError:  # Error handling
-                print(f'Could not find file game_data.json')
-
-        print('Loading npc data')
-        for i in range(len(data["npc_data"])):
-            npc = NPC(data["npc_data"][i])
-            name = data["npc_data"][i]["npc_name"]
-            self.npcs[name] = npc
-        print('Loading npc data completed')
-
-    def load_settings(self, data=None):
+    def load_game_data(self, data=None, path=WORLD_FILE):
+        """
+        Builds the world from data, or loads the world file's paged regions or
+        compiled snapshot. A missing or stale snapshot is rebuilt from the file,
+        read and parsed once, and its cross-references checked; worlds of
+        PAGED_ZONE_COUNT zones or more are then paged, so only the regions
+        around the player stay in memory. Reports how long loading took
+        """
+        timings = {}
+        started = time.perf_counter()
+        world = None
         if data is None:
-            try:
-                with open('game_data.json', 'r') as infile:
-                    data = json.load(infile)
-            except FileNotFoundError:  # Error handling
-                print(f'Could not find file game_data.json')
+            world = load_regions(path) or load_snapshot(path)
+        if world is not None:
+            timings["regions" if isinstance(world.zones, RegionTable) else "snapshot"] = time.perf_counter() - started
+        elif data is None:
+            fingerprint = source_fingerprint(path)
+            world = compile_world(path, timings)
+            if len(world.zones) >= PAGED_ZONE_COUNT:
+                paging = time.perf_counter()
+                write_regions(world, path, fingerprint)
+                world = load_regions(path) or world
+                timings["page"] = time.perf_counter() - paging
+        else:
+            problems = []
+            world = build_world(data, problems)
+            for problem in problems + validate_world(world):
+                print(f'World data: {problem}')
+        self.world = world
+        self._world_path = path if data is None else None
+        self._graph = None
+        self.zones = world.zones
+        self.quests = world.quests
+        self.npcs = world.npcs
+        self._settings = world.settings
+        self._objects = {obj._object_num: obj for obj in list(self.quests.values()) + list(self.npcs.values())}
+        self._changed = {}
+        if isinstance(self.zones, RegionTable):
+            self.zones.set_budget(self._settings.get("region_budget", REGION_BUDGET))
+        if self.adventurer.location not in self.zones:
+            if START_ZONE in world.zone_ids:
+                self.adventurer.move(world.zone_ids[START_ZONE])
+            else:
+                print(f'World data: starting zone {START_ZONE} does not exist')
+        total = time.perf_counter() - started
+        for step, seconds in timings.items():
+            metrics.observe(f"world.{step}", seconds)
+        metrics.observe("world.load", total)
+        print(f'Loaded {len(self.zones)} zones, {len(self.quests)} quests and {len(self.npcs)} NPCs in '
+              f'{total * 1000:.1f} ms (' + ", ".join(f'{step} {seconds * 1000:.1f} ms'
+                                                 for step, seconds in timings.items()) + ')')
+        return timings
+
+    def graph(self):
+        """
+        Returns the pathfinding graph of the world, precomputing it on first use
+        """
+        if self._graph is None:
+            self._graph = load_graph(self.world, self._world_path)
+        return self._graph
 
-        self._settings = data["settings"]
+    def travel(self, name):
+        """
+        Walks the shortest route to a named zone
+        """
+        graph = self.graph()
+        target = self.world.find_zone(name)
+        if target is None:
+            print(f"There is no place called {name}.")
+            return
+        route = graph.path(self.adventurer.location, target)
+        if route is None:
+            print(f"You cannot find a way to the {self.zones[target].get_name()} from here.")
+        elif not route:
+            print(f"You are already in the {self.zones[target].get_name()}.")
+        else:
+            for direction, zone_id in route:
+                print(f"You travel {direction} to the {self.zones[zone_id].get_name()}.")
+            with self.changing():
+                self.adventurer.move(target)
 
-    def load_game_data(self, data=None):
-        self.load_map_data(data)
-        self.load_quest_data(data)
-        self.load_npc_data(data)
-        self.load_settings(data)
+    def show_stats(self, service=""):
+        """
+        Prints the metrics recorded by the game, or by the named service
+        """
+        if not service:
+            report = metrics.registry.report()
+        elif service == "character":
+            reply = send_request("stats")
+            report = reply.get("metrics")
+            if report is None:
+                print(reply["message"])
+        elif service in ("image", "save", "theme"):
+            report = self._zeromq.service_stats(service)
+        else:
+            print(f"There is no {service} service.")
+            return
+        if report is not None:
+            for line in metrics.format_report(report):
+                print(line)
 
     def zone_info(self, zone):
         print(f"\nYou enter the {zone.get_name()}.")
         if zone.get_lore():
             print(zone.get_lore())
-        zone.get_directions()
+        for direction, target in self.world.exits_of(zone.get_id()):
+            print(f'{direction}: {self.zones[target].get_name()}')
 
     def display_image(self, byte_array):
         """
         Displays image from bytes with default image viewer
         """
         from PIL import Image  # To display images
-        import io
-        byte_image = io.BytesIO(byte_array)
-        image = Image.open(byte_image)
+        image = Image.open(FrameReader(byte_array))
         image.show()
 
     def play_theme(self, theme_bytes):
@@ -214,79 +333,250 @@ class Game:
         Plays audio file from bytes
         """
         import pygame
-        import io
         pygame.mixer.init()
-        pygame.mixer.stop()
-        theme = io.BytesIO(theme_bytes)
-        pygame.mixer.Sound(theme).play()
+        self.stop_sounds()
+        pygame.mixer.music.load(FrameReader(theme_bytes), "mp3")
+        pygame.mixer.music.play()
+
+    def stream_theme(self, theme):
+        """
+        Plays a theme while it is still being received
+        """
+        import pygame
+        pygame.mixer.init()
+        self.stop_sounds()
+        self._theme_stream = self._zeromq.stream_theme(theme)
+        if not self._theme_stream.wait_ready(PROMPT_ASSET_TIMEOUT):    # Service down or slow, skip the theme
+            self.stop_sounds()
+            return
+        try:
+            pygame.mixer.music.load(self._theme_stream, "mp3")
+        except pygame.error:    # Theme not available
+            return
+        pygame.mixer.music.play()
+
+    def show_zone_media(self, zone):
+        """
+        Displays the zone image and plays its theme, from prefetched assets when available
+        """
+        cache = self._prefetcher.cache
+        if self._settings["theme_sounds"] and zone._theme:     # Streams in the background while the image loads
+            theme = cache.lookup(("theme", zone._theme))
+            if theme is not None:
+                self.play_theme(theme)
+            else:
+                self.stream_theme(zone._theme)
+        if self._settings["image_display"]:
+            key = ("image", zone.get_name())
+            image = cache.lookup(key)
+            if image is None:       # Retrying a service that is down is left to the prefetcher, off the prompt
+                image = self._zeromq.get_assets([key], PROMPT_ASSET_TIMEOUT)[key]
+            if image is not None:
+                self.display_image(image)
+
+    def prefetch_neighbours(self, zone):
+        """
+        Queues assets of zones within prefetch_depth moves for background fetching, nearest first
+        """
+        depth = self._settings.get("prefetch_depth", PREFETCH_DEPTH)
+        budget = self._settings.get("prefetch_budget_mb", PREFETCH_BUDGET_MB) * 1024 * 1024
+        self._prefetcher.cache.set_budget(budget)
+        if isinstance(self.zones, RegionTable):     # Reading neighbours below pages in their regions
+            self.zones.set_budget(self._settings.get("region_budget", REGION_BUDGET))
+        keys = []
+        seen = {zone.get_id()}
+        frontier = [zone.get_id()]
+        for _ in range(depth):
+            reached = []
+            for current in frontier:
+                for _, zone_id in self.world.exits_of(current):
+                    if zone_id in seen:
+                        continue
+                    seen.add(zone_id)
+                    reached.append(zone_id)
+                    neighbour = self.zones[zone_id]
+                    if self._settings["image_display"]:
+                        keys.append(("image", neighbour.get_name()))
+                    if self._settings["theme_sounds"] and neighbour._theme:
+                        keys.append(("theme", neighbour._theme))
+            frontier = reached
+        self._prefetcher.prefetch(keys)
 
     def stop_sounds(self):
         """
         Stops playing current audio file
         """
         import pygame
+        if not pygame.mixer.get_init():
+            return
         pygame.mixer.stop()
+        pygame.mixer.music.stop()
+        if self._theme_stream is not None:
+            self._theme_stream.cancel()
+            self._theme_stream = None
+
+    def list_saves(self):
+        """
+        Prints the player's saves, newest first, and returns them
+        """
+        saves = self._zeromq.list_saves(self.adventurer.name)
+        if saves is None:
+            return None
+        if not saves:
+            print("You have no saves yet.")
+        for i, entry in enumerate(saves, 1):
+            saved_at = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["saved_at"]))
+            shared = " (shared save from an earlier version)" if entry["player"] != self.adventurer.name else ""
+            print(f"{i}. {entry['slot']} - {entry['location'] or 'unknown location'}, saved {saved_at}{shared}")
+        return saves
+
+    def choose_save(self, saves, prompt):
+        """
+        Asks for a save by number or name. Returns its slot name, or None to go back
+        """
+        while True:
+            choice = input(prompt).strip()
+            if choice.lower() == "back" or not choice:
+                return None
+            if choice.isdigit() and 1 <= int(choice) <= len(saves):
+                return saves[int(choice) - 1]["slot"]
+            if any(entry["slot"] == choice for entry in saves):
+                return choice
+            comm_err()
 
     def save_game(self):
         """
-        Saves current game state to a save slot
+        Saves current game state to a named save slot
         """
-        slot = 0
-        while not (0 < slot < 4):
-            slot = int(input("\nWhich slot would you like to save to (1,2,3)? "))
+        print()
+        if self.list_saves() is None:
+            return
+        slot = input("\nName this save (saving over an existing name replaces it) or 'back': ").strip()
+        if not slot or slot.lower() == "back":
+            return
         save_data = self.export_game_data()
-        self._zeromq.save_game_data('save', str(slot), save_data)
+        self._zeromq.save_game_data('save', slot, save_data, self.adventurer.name)
 
     def load_from_save(self):
         """
-        Loads game from save slot
+        Loads game from a named save slot
         """
-        slot = 0
-        while not (0 < slot < 4):
-            slot = int(input("\nWhich save slot would you like to load (1,2,3)? "))
-        data = self._zeromq.load_game_data('load', str(slot))
-        self.load_game_data(data)
-        print(f'Successfully loaded save file {slot}')
+        print()
+        saves = self.list_saves()
+        if not saves:
+            return
+        slot = self.choose_save(saves, "\nEnter the number or name of the save to load, or 'back': ")
+        if slot is None:
+            return
+        data = self._zeromq.load_game_data('load', slot, self.adventurer.name)
+        if data is None:
+            return
+        self.apply_save(data)
+        print(f'Successfully loaded save {slot}')
+
+    def manage_saves(self):
+        """
+        Menu to delete and copy saves
+        """
+        while True:
+            print()
+            saves = self.list_saves()
+            if not saves:
+                return
+            command = input("\nEnter 'delete', 'copy' or 'back': ").lower().strip()
+            if command == "back":
+                return
+            elif command == "delete":
+                slot = self.choose_save(saves, "Enter the number or name of the save to delete: ")
+                if slot is not None and input(f"Delete {slot}? (Y/N) ").lower().strip() == "y":
+                    self._zeromq.delete_save(self.adventurer.name, slot)
+            elif command == "copy":
+                slot = self.choose_save(saves, "Enter the number or name of the save to copy: ")
+                new_slot = slot and input("Name the copy: ").strip()
+                if new_slot:
+                    self._zeromq.copy_save(self.adventurer.name, slot, new_slot)
+            else:
+                comm_err()
 
     def export_game_data(self):
         """
-        Parses objects out to dictionaries to store in json
+        Returns the saveable state that differs from the loaded world: player
+        position, quests and NPCs that changed (keyed by object_num), and settings
+        """
+        changes = {}
+        for object_num, original in self._changed.items():
+            state = self._objects[object_num].state()
+            if state != original:
+                changes[str(object_num)] = state
+        location = self.zones[self.adventurer.location].get_name()
+        return {"format": "delta", "player": {"location": location, "score": self.adventurer.score},
+                "objects": changes, "settings": self.export_settings()}
+
+    def export_world_data(self):
+        """
+        Parses every object out to dictionaries in the game_data.json layout
         """
         data = {"zone_data": self.export_map_data(), "quest_data": self.export_quest_data(),
                 "npc_data": self.export_npc_data(), "settings": self.export_settings()}
         return data
 
-    def export_npc_data(self):
-        npc_data = []
-        for npc in self.npcs.values():
-            data = {"object_num": npc._object_num, "npc_name": npc._npc_name, "hostile": npc._hostile,
-                    "stats": npc._stats, "alive": npc._alive, "reputation": npc._reputation, "dialogue": npc._dialogue}
-            npc_data.append(data)
+    def change_object(self, object_num, state):
+        """
+        Updates the saveable state of a quest or NPC, remembering how it was loaded
+        """
+        obj = self._objects.get(object_num)
+        if obj is None:
+            return
+        with self.changing():
+            if object_num not in self._changed:
+                self._changed[object_num] = obj.state()
+            obj.restore(state)
 
-        return npc_data
+    def revert_changes(self):
+        """
+        Puts every changed quest and NPC back to its loaded state
+        """
+        with self.changing():
+            for object_num, original in self._changed.items():
+                self._objects[object_num].restore(original)
+            self._changed = {}
 
-    def export_quest_data(self):
-        quest_data = []
-        for quest in self.quests.values():
-            data = {"object_num": quest._object_num, "quest_name": quest._quest_name, "quest_progress": quest._progress,
-                    "quest_complete": quest._complete, "quest_text": quest._quest_text}
-            quest_data.append(data)
+    def apply_save(self, data):
+        """
+        Applies a save over the loaded world. Older saves holding the whole
+        world are applied through their quest, NPC and settings sections
+        """
+        with self.changing():
+            self.revert_changes()
+            if "zone_data" in data:
+                objects = data["quest_data"] + data["npc_data"]
+                changes = {obj["object_num"]: obj for obj in objects}
+            else:
+                changes = {int(object_num): state for object_num, state in data["objects"].items()}
+                player = data.get("player", {})
+                if player.get("location") in self.world.zone_ids:
+                    self.adventurer.move(self.world.zone_ids[player["location"]])
+                self.adventurer.score = player.get("score", self.adventurer.score)
+            for object_num, state in changes.items():
+                obj = self._objects.get(object_num)
+                if obj is not None and obj.state() != obj.saveable(state):
+                    self.change_object(object_num, obj.saveable(state))
+            self._settings.update(data["settings"])
+
+    def export_npc_data(self):
+        return [npc.to_data() for npc in self.npcs.values()]
 
-        return quest_data
+    def export_quest_data(self):
+        return [quest.to_data() for quest in self.quests.values()]
 
     def export_settings(self):
-        return self._settings
+        """
+        Returns a copy of the settings, so an export taken under the state lock stays as it was when encoded later
+        """
+        return dict(self._settings)
 
     def export_map_data(self):
-        zone_data = []
-        for zone in self.zones.values():
-            data = {"object_num": zone._object_num, "zone_name": zone._zone_name, "zone_lore": zone._lore,
-                    "north": zone.directions["north"], "south": zone.directions["south"],
-                    "east": zone.directions["east"], "west": zone.directions["west"], "npcs": zone._npcs,
-                    "items": zone._items, "theme": zone._theme}
-            zone_data.append(data)
-
-        return zone_data
+        return [self.world.zone_data(zone_id) for zone_id in self.zones]
 
     def game_menu(self):
         """
@@ -297,15 +587,13 @@ class Game:
             self._help.message()
             zone = self.zones[self.adventurer.location]
             self.zone_info(zone)
-            if self._settings["image_display"]:
-                self.display_image(self._zeromq.get_image('zone', zone.get_name()))
-            if self._settings["theme_sounds"] and zone._theme:
-                self.play_theme(self._zeromq.get_theme(zone._theme))
+            self.show_zone_media(zone)
+            self.prefetch_neighbours(zone)
 
             command = input("\nWhat would you like to do? ").lower().strip()
             print("\n")
             if command == "exit":
-                exit_game()
+                exit_game(self.shutdown)
             elif command == "help":
                 self._help.show_commands()
             elif command == "character":
@@ -316,13 +604,24 @@ class Game:
                 self.save_game()
             elif command == "load":
                 self.load_from_save()
+            elif command == "saves":
+                self.manage_saves()
             elif command == "mute":
                 self.stop_sounds()
-            elif command in zone.directions:
-                if zone.directions[command] is None:
+            elif command.startswith("travel "):
+                self.travel(command[len("travel "):].strip())
+            elif command == "stats" or command.startswith("stats "):
+                self.show_stats(command[len("stats"):].strip())
+            elif command in ("profile on", "profile off"):
+                metrics.configure(profiling=command == "profile on", tracing=command == "profile on")
+                print(f'Profiling is {command[len("profile "):]}.')
+            elif command in DIRECTION_SLOTS:
+                target = self.world.exit(self.adventurer.location, command)
+                if target is None:
                     print("You cannot go that way.")
                 else:
-                    self.adventurer.move(zone.directions[command])
+                    with self.changing():
+                        self.adventurer.move(target)
             else:
                 comm_err()
 
@@ -338,7 +637,15 @@ class Game:
             selection = "_".join(selection.split())
             if selection == "back":
                 return
-            if selection in self._settings:
+            if selection in self._settings and not isinstance(self._settings[selection], bool):
+                value = input(f'{selection} is currently {self._settings[selection]}. Enter a new value: ')
+                try:
+                    with self.changing():
+                        self._settings[selection] = max(0, int(value))
+                    print(f'{selection} has been set to {self._settings[selection]}.')
+                except ValueError:
+                    comm_err()
+            elif selection in self._settings:
                 if self._settings[selection]:
                     print(f'{selection} is currently toggled on. Do you want to toggle this setting off? ', end="")
                 else:
@@ -358,213 +665,669 @@ class Game:
         """
         Toggles a setting on/off
         """
+        with self.changing():
+            self._settings[setting] = not self._settings[setting]
         if self._settings[setting]:
-            self._settings[setting] = False
-            print(f'{setting} has been toggled off.')
-        else:
-            self._settings[setting] = True
             print(f'{setting} has been toggled on.')
+        else:
+            print(f'{setting} has been toggled off.')
 
 
-class Zone:
-    def __init__(self, data):
-        self._object_num = data["object_num"]
-        self._zone_name = data["zone_name"]
-        self._lore = data["zone_lore"]
-        self.directions = {"north": data["north"],
-                           "south": data["south"],
-                           "east": data["east"],
-                           "west": data["west"]}
-        self._npcs = data["npcs"]
-        self._items = data["items"]
-        self._theme = data["theme"]
+class FrameReader(io.RawIOBase):
+    """
+    Read-only file object over a received buffer, so decoders read message
+    frames in place instead of from a copy
+    """
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._position = 0
 
-    def get_npcs(self):
-        return self._npcs
+    def readable(self):
+        return True
 
-    def get_items(self):
-        return self._items
+    def seekable(self):
+        return True
 
-    def get_directions(self):
-        for key, val in self.directions.items():
-            if val is not None:
-                print(f'{key}: {val}')
+    def readinto(self, b):
+        count = min(len(b), len(self._view) - self._position)
+        b[:count] = self._view[self._position:self._position + count]
+        self._position += count
+        return count
 
-    def get_lore(self):
-        return self._lore
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
 
-    def get_name(self):
-        return self._zone_name
+    def tell(self):
+        return self._position
 
 
-class Player:
-    def __init__(self):
-        self.name = "Player"
-        self.score = 0
-        self.location = "Town"
+class ThemeStream(io.RawIOBase):
+    """
+    File object over a theme that is still being received. A background
+    thread requests fixed-size chunks from the theme service, keeping at most
+    STREAM_CREDIT requests outstanding, and reads block only until the chunks
+    they cover have arrived. The first and last chunks are fetched before the
+    rest because decoders read both ends of the file before playing.
+    """
+    def __init__(self, context, address, theme, chunk_size=STREAM_CHUNK_SIZE, credit=STREAM_CREDIT,
+                 timeout=STREAM_TIMEOUT):
+        self._context = context
+        self._address = address
+        self._theme = theme
+        self._chunk_size = chunk_size
+        self._credit = credit
+        self._timeout = timeout
+        self._buffer = None
+        self._received = None           # One flag per chunk
+        self._size = None
+        self._failed = False
+        self._cancelled = False
+        self._position = 0
+        self._ready = threading.Condition()
+        self._thread = threading.Thread(target=self._fetch, daemon=True)
+        self._thread.start()
+
+    def _request(self, socket, offset):
+        request = {"request": "chunk", "theme": self._theme, "offset": offset, "size": self._chunk_size}
+        socket.send_multipart([b"", json.dumps(request).encode()])
+
+    def _fetch(self):
+        socket = self._context.socket(zmq.DEALER)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(self._address)
+        try:
+            self._request(socket, 0)
+            pending = None
+            outstanding = 1
+            while outstanding and not self._cancelled:
+                if not socket.poll(self._timeout):
+                    break
+                frames = socket.recv_multipart(copy=False)
+                if len(frames) < 3:     # Theme not available
+                    break
+                _, meta, chunk = frames
+                outstanding -= 1
+                meta = json.loads(meta.bytes)
+                with self._ready:
+                    if self._buffer is None:
+                        self._size = meta["size"]
+                        self._buffer = bytearray(self._size)
+                        count = -(-self._size // self._chunk_size)
+                        self._received = bytearray(count)
+                        pending = [count - 1] + list(range(1, count - 1)) if count > 1 else []
+                    start = meta["offset"]
+                    self._buffer[start:start + meta["length"]] = chunk.buffer
+                    self._received[start // self._chunk_size] = 1
+                    self._ready.notify_all()
+                while pending and outstanding < self._credit:
+                    self._request(socket, pending.pop(0) * self._chunk_size)
+                    outstanding += 1
+        finally:
+            socket.close()
+            with self._ready:
+                if self._received is None or not all(self._received):
+                    self._failed = True
+                self._ready.notify_all()
+
+    def _available(self, end):
+        first = self._position // self._chunk_size
+        last = (end - 1) // self._chunk_size
+        return all(self._received[first:last + 1])
+
+    def _ends_received(self):
+        return self._received is not None and self._received[0] and self._received[-1]
+
+    def wait_ready(self, timeout):
+        """
+        Waits up to timeout milliseconds for the first and last chunks, which
+        decoders read before playing, and returns whether they arrived
+        """
+        with self._ready:
+            self._ready.wait_for(lambda: self._ends_received() or self._failed, timeout / 1000)
+            return bool(self._ends_received())
+
+    def cancel(self):
+        self._cancelled = True
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        with self._ready:
+            self._ready.wait_for(lambda: self._size is not None or self._failed)
+            if self._size is None:
+                return 0
+            end = min(self._position + len(b), self._size)
+            if end <= self._position:
+                return 0
+            self._ready.wait_for(lambda: self._available(end) or self._failed)
+            if not self._available(end):
+                return 0
+            count = end - self._position
+            b[:count] = self._buffer[self._position:end]
+            self._position = end
+            return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        with self._ready:
+            if whence == io.SEEK_END:
+                self._ready.wait_for(lambda: self._size is not None or self._failed)
+                offset += self._size or 0
+            elif whence == io.SEEK_CUR:
+                offset += self._position
+            self._position = max(0, offset)
+            return self._position
+
+    def tell(self):
+        return self._position
+
+
+class AssetPrefetcher:
+    """
+    Fetches zone images and themes on a background thread into a bounded
+    cache, so moving to a nearby zone does not wait on the asset services
+    """
+    def __init__(self, budget):
+        self.cache = AssetCache(budget)
+        self._queue = []
+        self._wanted = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def prefetch(self, keys):
+        """
+        Replaces the pending work with keys, each ("image", zone name) or ("theme", theme)
+        """
+        with self._wanted:
+            self._queue = list(keys)
+            self._wanted.notify()
 
-    def change_name(self, name):
-        self.name = name
+    def _run(self):
+        pipe = ZeroPipe()               # Sockets belong to this thread
+        while True:
+            with self._wanted:
+                self._wanted.wait_for(lambda: self._queue)
+                keys = [key for key in self._queue[:PREFETCH_BATCH] if key not in self.cache]
+                del self._queue[:PREFETCH_BATCH]
+            for key, payload in pipe.get_assets(keys).items():
+                if payload is not None:
+                    self.cache.put(key, None, payload)
 
-    def move(self, zone_name):
-        self.location = zone_name
 
-    def change_score(self, points):
-        self.score += points
+class Autosaver:
+    """
+    Saves the game to AUTOSAVE_SLOT on a background thread. Changes only
+    mark the game dirty; the thread saves at most once per autosave
+    interval, so a burst of changes becomes one save, and the prompt never
+    waits on the save service
+    """
+    def __init__(self, game):
+        self._game = game
+        self._dirty = False
+        self._stopping = False
+        self._pending = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def mark_dirty(self):
+        with self._pending:
+            self._dirty = True
+            self._pending.notify()
+
+    def stop(self):
+        """
+        Saves any unsaved changes right away and waits for that save to finish
+        """
+        with self._pending:
+            self._stopping = True
+            self._pending.notify()
+        self._thread.join((REQUEST_RETRIES + 1) * REQUEST_TIMEOUT / 1000 + 1)
+
+    def _run(self):
+        pipe = ZeroPipe()               # Sockets belong to this thread
+        last_save = time.monotonic()
+        while True:
+            with self._pending:
+                self._pending.wait_for(lambda: self._dirty or self._stopping)
+                remaining = last_save + self._game.autosave_interval() - time.monotonic()
+                if remaining > 0:       # Let changes made meanwhile join this save
+                    self._pending.wait_for(lambda: self._stopping, remaining)
+                dirty, self._dirty = self._dirty, False
+                stopping = self._stopping
+            if dirty and self._game.autosave_interval() > 0:
+                player, data = self._game.snapshot()
+                pipe.save_game_data('save', AUTOSAVE_SLOT, data, player, quiet=True)
+                last_save = time.monotonic()
+            if stopping:
+                pipe.end_connection()
+                return
 
 
-class Quest:
-    def __init__(self, data):
-        self._object_num = data["object_num"]
-        self._quest_name = data["quest_name"]
-        self._progress = data["quest_progress"]
-        self._complete = data["quest_complete"]
-        self._quest_text = data["quest_text"]
+class ServiceUnavailable(Exception):
+    """
+    Raised when a microservice does not reply within its timeout and retries
+    """
+
+
+class ServiceChannel:
+    """
+    DEALER connection to one microservice with per-request timeouts. Several
+    requests may be in flight at once and their replies may come back in any
+    order, so each request carries an id in an envelope frame that the
+    service's REP socket echoes back. When a reply times out the socket is
+    replaced, dropping anything still in flight, and request() retries with
+    backoff
+    """
+    def __init__(self, context, address, timeout=REQUEST_TIMEOUT, retries=REQUEST_RETRIES, name="service"):
+        self.address = address
+        self.timeout = timeout
+        self.retries = retries
+        self.name = name                    # Label of the channel's timers and counters
+        self._timer = f"client.{name}"
+        self._context = context
+        self._next_id = 0
+        self.socket = None
+        self.reset()
+
+    def reset(self):
+        """
+        Discards the socket along with any requests still in flight
+        """
+        if self.socket is not None:
+            self.socket.close(linger=0)
+        self.socket = self._context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.connect(self.address)
+
+    def send(self, *frames):
+        """
+        Sends a request without waiting and returns its id
+        """
+        self._next_id += 1
+        request_id = self._next_id.to_bytes(4, 'big')
+        self.socket.send_multipart([request_id, b""] + list(frames))
+        return request_id
 
+    def read(self):
+        """
+        Returns the id and frames of a reply that is ready to be read
+        """
+        frames = self.socket.recv_multipart(copy=False)
+        return frames[0].bytes, frames[2:]
 
-class NPC:
-    def __init__(self, data):
-        self._object_num = data["object_num"]
-        self._npc_name = data["npc_name"]
-        self._hostile = data["hostile"]
-        self._stats = data["stats"]
-        self._alive = data["alive"]
-        self._reputation = data["reputation"]
-        self._dialogue = data["dialogue"]
+    def receive(self, request_id):
+        """
+        Returns the frames of the reply to a request, skipping replies to
+        abandoned ones, or raises ServiceUnavailable after resetting the socket
+        """
+        while self.socket.poll(self.timeout):
+            reply_id, frames = self.read()
+            if reply_id == request_id:
+                return frames
+        self.reset()
+        raise ServiceUnavailable(self.address)
+
+    def request(self, *frames, retries=None):
+        """
+        Sends a request and waits for its reply, retrying after timeouts
+        """
+        retries = self.retries if retries is None else retries
+        delay = RETRY_BACKOFF
+        with metrics.timed(self._timer):
+            for attempt in range(retries + 1):
+                request_id = self.send(*frames)
+                try:
+                    return self.receive(request_id)
+                except ServiceUnavailable:
+                    metrics.count(self._timer + ".timeouts")
+                    if attempt == retries:
+                        raise
+                    time.sleep(delay)
+                    delay *= 2
 
 
 class ZeroPipe:
     """
     Initializes connection for microservice communication
     """
-    def __init__(self):
+    def __init__(self, encoding='raw', save_encoding='compact'):
+        self.encoding = encoding                            # 'raw' binary frames, or 'base64' for older services
+        self.save_encoding = save_encoding                  # 'compact' binary saves, or 'json' for older services
         self.context = zmq.Context()                        # Sets up the environment so that we are able to begin
-        self.socket = self.context.socket(zmq.REQ)          # Request socket type
-        self.socket.connect("tcp://localhost:5555")
-        self.save_socket = self.context.socket(zmq.REQ)
-        self.save_socket.connect("tcp://localhost:5556")
-        self.sound_socket = self.context.socket(zmq.REQ)
-        self.sound_socket.connect("tcp://localhost:5557")
+        self.image_channel = ServiceChannel(self.context, IMAGE_ADDRESS, name="image")
+        self.save_channel = ServiceChannel(self.context, SAVE_ADDRESS, name="save")
+        self.sound_channel = ServiceChannel(self.context, THEME_ADDRESS, name="theme")
 
-    def get_theme(self, theme):
+    def decode_asset(self, frames):
+        """
+        Returns an asset reply as a buffer: a memoryview of the data frame in
+        raw mode, or the decoded bytes in base64 mode. Returns None if the
+        service does not have the asset
+        """
+        if self.encoding == 'raw':
+            return frames[1].buffer if len(frames) > 1 else None
         import base64
-        request = {"theme": theme}
-        self.sound_socket.send_json(request)
-        byte_sound = self.sound_socket.recv()
-        byte_array = bytearray(base64.b64decode(byte_sound))
-        return byte_array
-
-    def save_game_data(self, request, slot, data):
-        self.save_socket.send_json({"request": request, "slot": slot, "data": data})
-        response = self.save_socket.recv()
-        if response:
-            print(f'Successfully saved to slot {slot}')
-
-    def load_game_data(self, request, slot):
-        self.save_socket.send_json({"request": request, "slot": slot})
-        load_data = self.save_socket.recv_json()
+        data = frames[0].bytes
+        return base64.b64decode(data) if data else None
+
+    def asset_request(self, key):
+        """
+        Returns the channel and request for an asset key, ("image", zone name) or ("theme", theme)
+        """
+        kind, name = key
+        if kind == "image":
+            return self.image_channel, {"type": "zone", "name": name, "encoding": self.encoding}
+        return self.sound_channel, {"theme": name, "encoding": self.encoding}
+
+    def get_asset(self, key):
+        channel, request = self.asset_request(key)
+        try:
+            return self.decode_asset(channel.request(json.dumps(request).encode()))
+        except ServiceUnavailable:
+            return None
+
+    def get_assets(self, keys, timeout=REQUEST_TIMEOUT):
+        """
+        Requests several assets at once, in flight on all services in
+        parallel, waiting at most timeout milliseconds without retrying.
+        Returns a dictionary of key to payload, None for assets that are
+        missing or timed out
+        """
+        with metrics.timed("client.assets"):
+            results = dict.fromkeys(keys)
+            waiting = {}                                        # (channel, request id) -> key
+            channels = {}
+            for key in keys:
+                channel, request = self.asset_request(key)
+                waiting[channel, channel.send(json.dumps(request).encode())] = key
+                channels[channel.socket] = channel
+            poller = zmq.Poller()
+            for socket in channels:
+                poller.register(socket, zmq.POLLIN)
+            deadline = time.monotonic() + timeout / 1000
+            while waiting:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                for socket, _ in poller.poll(remaining * 1000):
+                    channel = channels[socket]
+                    request_id, frames = channel.read()
+                    key = waiting.pop((channel, request_id), None)
+                    if key is not None:
+                        results[key] = self.decode_asset(frames)
+            for channel in {channel for channel, _ in waiting}:
+                channel.reset()
+            metrics.count("client.assets.missing", sum(payload is None for payload in results.values()))
+            return results
+
+    def get_theme(self, theme):
+        return self.get_asset(("theme", theme))
+
+    def service_stats(self, service, **switches):
+        """
+        Returns the metrics of the image, save or theme service, after it
+        applies any switches given (see metrics.handle_stats), or None
+        """
+        channel = {"image": self.image_channel, "save": self.save_channel, "theme": self.sound_channel}[service]
+        try:
+            reply = channel.request(json.dumps({"request": "stats", **switches}).encode())
+        except ServiceUnavailable:
+            print(f'Could not reach the {service} service.')
+            return None
+        return json.loads(reply[0].bytes).get("metrics")
+
+    def save_request(self, request, **fields):
+        """
+        Sends a catalog request to the save service. Returns True when it
+        succeeded, the decoded reply when it carries data, or None after
+        printing why it failed
+        """
+        try:
+            response = self.save_channel.request(json.dumps({"request": request, **fields}).encode())
+        except ServiceUnavailable:
+            print('Could not reach the save service.')
+            return None
+        if response[0].bytes == b'True':
+            return True
+        reply = json.loads(response[0].bytes)
+        if "error" in reply:
+            print(reply["error"])
+            return None
+        return reply
+
+    def list_saves(self, player):
+        """
+        Returns the catalog entries of a player's saves, newest first
+        """
+        reply = self.save_request('list', player=player)
+        return reply and reply["saves"]
+
+    def delete_save(self, player, slot):
+        if self.save_request('delete', player=player, slot=slot):
+            print(f'Deleted save {slot}')
+
+    def copy_save(self, player, slot, new_slot):
+        if self.save_request('copy', player=player, slot=slot, new_slot=new_slot):
+            print(f'Copied save {slot} to {new_slot}')
+
+    def save_game_data(self, request, slot, data, player=None, quiet=False):
+        header = {"request": request, "player": player, "slot": slot,
+                  "location": data.get("player", {}).get("location")}
+        if self.save_encoding == 'compact':
+            frames = (json.dumps({**header, "encoding": "compact"}).encode(), save_format.encode(data))
+        else:
+            frames = (json.dumps({**header, "data": data}).encode(),)
+        try:
+            with metrics.timed("client.save.save"):
+                response = self.save_channel.request(*frames)
+        except ServiceUnavailable:
+            if not quiet:
+                print('Could not reach the save service. Your game was not saved.')
+            return False
+        if response[0].bytes == b'True':
+            if not quiet:
+                print(f'Successfully saved {slot}')
+            return True
+        if not quiet:
+            print(f'Your game was not saved: {json.loads(response[0].bytes).get("error")}')
+        return False
+
+    def load_game_data(self, request, slot, player=None):
+        try:
+            with metrics.timed("client.save.load"):
+                response = self.save_channel.request(json.dumps(
+                    {"request": request, "player": player, "slot": slot, "encoding": self.save_encoding}).encode())
+        except ServiceUnavailable:
+            print('Could not reach the save service.')
+            return None
+        if len(response) > 1:
+            try:
+                return save_format.decode(response[1].buffer)
+            except ValueError as error:
+                print(f'Could not read the save: {error}')
+                return None
+        load_data = json.loads(response[0].bytes)
+        if "error" in load_data:
+            print(load_data["error"])
+            return None
         return load_data
 
+    def stream_theme(self, theme):
+        """
+        Starts receiving a theme in chunks and returns a file object that can
+        be played while the rest arrives
+        """
+        return ThemeStream(self.context, THEME_ADDRESS, theme)
+
     def get_image(self, obj_type, name):
-        import base64
-        request = {"type": obj_type, "name": name}
-        self.socket.send_json(request)
-        byte_image = self.socket.recv()
-        byte_array = bytearray(base64.b64decode(byte_image))
-        return byte_array
+        return self.get_asset(("image", name))
 
     def end_connection(self):
         """
         Terminates the connection
         """
-        self.context.destroy()
-        self.socket.close()
+        self.context.destroy(linger=0)
 
 # -------------------------------------------------CHARACTER--------------------------------------------------------- #
 
-def write_request(request):
-    """Write a request to request.txt."""
-    with open("request.txt", "w") as f:
-        f.write(request)
-
-def read_response():
-    """Read the response from response.txt."""
+_character_channel = None
+_character_session = None
+_character_active = None        # Name last made active, selected again if the service drops the session
+
+# Characters shown per page when choosing a character
+CHARACTER_PAGE_SIZE = 10
+
+def character_channel():
+    """Return the channel to the character microservice. Commands are not retried, as most are not idempotent."""
+    global _character_channel
+    if _character_channel is None:
+        _character_channel = ServiceChannel(zmq.Context.instance(), CHARACTER_ADDRESS, retries=0, name="character")
+    return _character_channel
+
+def character_call(request):
+    reply = json.loads(character_channel().request(json.dumps(request).encode())[0].bytes)
+    if "status" not in reply and "error" in reply:     # Failure reported by the worker pool itself
+        return {"status": "error", "message": reply["error"]}
+    return reply
+
+def open_character_session():
+    """Open a session on the character service, with the last active character active again."""
+    global _character_session
+    _character_session = character_call({"command": "open_session"})["session"]
+    if _character_active is not None:
+        character_call({"command": "set_active_character", "session": _character_session, "name": _character_active})
+
+def track_active_character(request, reply):
+    """Remember the character a successful request made active."""
+    global _character_active
+    if reply.get("status") != "success":
+        return
+    if request["command"] == "set_active_character":
+        _character_active = request.get("name")
+    elif request["command"] == "batch":
+        for command, result in zip(request.get("commands", []), reply.get("results", [])):
+            if command.get("command") == "set_active_character" and result.get("status") == "success":
+                _character_active = command.get("name")
+
+def send_request(command, **params):
+    """Send a request within this client's session and wait for the response."""
     try:
-        with open("response.txt", "r") as f:
-            return f.read().strip()
-    except FileNotFoundError:
-        return None
+        if _character_session is None:
+            open_character_session()
+        request = {"command": command, "session": _character_session}
+        request.update(params)
+        with metrics.timed(f"client.character.{command}"):
+            reply = character_call(request)
+            if reply.get("message") == "Unknown session":       # Expired while the game sat idle
+                open_character_session()
+                request["session"] = _character_session
+                reply = character_call(request)
+        track_active_character(request, reply)
+        return reply
+    except ServiceUnavailable:
+        return {"status": "error", "message": "The character service is not responding."}
+
+def close_character_session():
+    """Release this client's session on the character service, if it opened one."""
+    global _character_session
+    if _character_session is not None:
+        try:
+            character_call({"command": "close_session", "session": _character_session})
+        except ServiceUnavailable:      # Left to expire after SESSION_IDLE_TIMEOUT on the service
+            pass
+        _character_session = None
+
+class CharacterBatch:
+    """
+    Collects character commands to send in a single round trip. With
+    transaction=True the service applies all of them or none of them.
+    """
+    def __init__(self, transaction=False):
+        self._commands = []
+        self._transaction = transaction
+
+    def add(self, command, **params):
+        request = {"command": command}
+        request.update(params)
+        self._commands.append(request)
+        return self
+
+    def send(self):
+        """Send the queued commands and return the service's reply with one result per command."""
+        commands, self._commands = self._commands, []
+        return send_request("batch", commands=commands, transaction=self._transaction)
+
+def create_character(name, job):
+    """Create a character and make it active in one transactional request."""
+    batch = CharacterBatch(transaction=True)
+    batch.add("create_new_character", name=name, job=job).add("set_active_character", name=name)
+    reply = batch.send()
+    return reply["results"][0] if "results" in reply else reply
+
+def prompt_new_character():
+    """Prompt for a name and job until a character is created and made active, and return its name."""
+    while True:
+        name = input("Enter character name: ").strip()
+        job = input("Choose a job (Warrior, Mage, Rogue): ").strip().title()
+        if job not in ["Warrior", "Mage", "Rogue"]:
+            print("Invalid job.")
+            continue
+        result = create_character(name, job)
+        if result["status"] == "success":
+            print("Character created successfully!")
+            return name
+        else:
+            print(result["message"])
 
-def clear_response():
-    """Remove response.txt after reading."""
-    try:
-        os.remove("response.txt")
-    except FileNotFoundError:
-        pass
-
-def response_available():
-    """Check if a response is available."""
-    return os.path.exists("response.txt")
-
-def send_request(request):
-    """Send a request and wait for the response."""
-    write_request(request)
-    while not response_available():
-        time.sleep(1)
-    response = read_response()
-    clear_response()
-    return json.loads(response)
+def fetch_character_page(prefix="", cursor=None):
+    """Fetch one page of character names, waiting on the user while the service is not responding."""
+    while True:
+        page = send_request("get_character_list", prefix=prefix, cursor=cursor, limit=CHARACTER_PAGE_SIZE)
+        if page["status"] == "success":
+            return page
+        input(page["message"] + " Press enter to try again. ")
 
 def initialize_character():
-    """Prompt the user to create a new character or choose an existing one."""
-    character_list = send_request("get_character_list")
-    if character_list:
+    """Prompt the user to create a new character or choose an existing one, and return its name."""
+    prefix = ""
+    page = fetch_character_page()
+    if not page["names"]:
+        print("No existing characters. Please create a new character.")
+        return prompt_new_character()
+    while True:
         print("Existing characters:")
-        for idx, name in enumerate(character_list, start=1):
+        for idx, name in enumerate(page["names"], start=1):
             print(f"{idx}. {name}")
-        while True:
-            choice = input("Enter the number of the character to use, or 'new' to create a new character: ").strip()
-            if choice.lower() == "new":
-                while True:
-                    name = input("Enter character name: ").strip()
-                    job = input("Choose a job (Warrior, Mage, Rogue): ").strip().title()
-                    if job not in ["Warrior", "Mage", "Rogue"]:
-                        print("Invalid job.")
-                        continue
-                    result = send_request(f"create_new_character name={name} job={job}")
-                    if result["status"] == "success":
-                        print("Character created successfully!")
-                        send_request(f"set_active_character name={name}")
-                        break
-                    else:
-                        print(result["message"])
-                break
-            else:
-                try:
-                    num = int(choice)
-                    if 1 <= num <= len(character_list):
-                        selected_name = character_list[num - 1]
-                        send_request(f"set_active_character name={selected_name}")
-                        break
-                    else:
-                        print("Invalid number.")
-                except ValueError:
-                    print("Invalid input.")
-    else:
-        print("No existing characters. Please create a new character.")
-        while True:
-            name = input("Enter character name: ").strip()
-            job = input("Choose a job (Warrior, Mage, Rogue): ").strip().title()
-            if job not in ["Warrior", "Mage", "Rogue"]:
-                print("Invalid job.")
-                continue
-            result = send_request(f"create_new_character name={name} job={job}")
-            if result["status"] == "success":
-                print("Character created successfully!")
-                send_request(f"set_active_character name={name}")
-                break
-            else:
-                print(result["message"])
+        if page["next_cursor"]:
+            print("Type 'more' to see more characters.")
+        choice = input("Enter the number of the character to use, 'find <name>' to search, "
+                       "or 'new' to create a new character: ").strip()
+        if choice.lower() == "new":
+            return prompt_new_character()
+        elif choice.lower() == "more" and page["next_cursor"]:
+            page = fetch_character_page(prefix, page["next_cursor"])
+        elif choice.lower().startswith("find"):
+            prefix = choice[4:].strip()
+            page = fetch_character_page(prefix)
+        else:
+            try:
+                num = int(choice)
+                if 1 <= num <= len(page["names"]):
+                    selected_name = page["names"][num - 1]
+                    send_request("set_active_character", name=selected_name)
+                    return selected_name
+                else:
+                    print("Invalid number.")
+            except ValueError:
+                print("Invalid input.")
 
 def manage_character():
     """Manage the active character via the microservice."""
@@ -586,7 +1349,7 @@ def manage_character():
                     print(f"{key}: {value}")
         elif choice == "2":
             new_name = input("Enter new name for your character: ").strip()
-            result = send_request(f"update_character_name new_name={new_name}")
+            result = send_request("update_character_name", new_name=new_name)
             if result["status"] == "success":
                 print("Character name updated successfully!")
             else:
@@ -594,7 +1357,7 @@ def manage_character():
         elif choice == "3":
             try:
                 exp = int(input("Enter experience points to add: ").strip())
-                result = send_request(f"add_experience exp_points={exp}")
+                result = send_request("add_experience", exp_points=exp)
                 if result["status"] == "success":
                     print(f"Added {exp} experience points.")
                 else:
@@ -618,7 +1381,7 @@ def manage_character():
 def change_name():
     """Change the active character's name."""
     new_name = input("Enter new name for your character: ").strip()
-    result = send_request(f"update_character_name new_name={new_name}")
+    result = send_request("update_character_name", new_name=new_name)
     if result["status"] == "success":
         print("Character name updated successfully!")
     else:
@@ -629,5 +1392,5 @@ if __name__ == "__main__":
     adventure = Game()
     adventure.start_menu()
     adventure.load_game_data()
-    initialize_character()
+    adventure.adventurer.change_name(initialize_character())
     adventure.game_menu()
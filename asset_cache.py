@@ -0,0 +1,148 @@
+# Asset cache shared by the asset microservices
+
+import os
+import json
+import base64
+import threading
+from collections import OrderedDict
+
+
+class AssetCache:
+    """
+    In-memory LRU cache of asset payloads with a byte budget.
+
+    Entries remember the modification time of the file they were read from
+    and are reloaded when it changes on disk. The cache may be shared
+    between threads.
+    """
+    def __init__(self, budget):
+        self._budget = budget
+        self._entries = OrderedDict()   # key -> (mtime, payload), least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key, path, load):
+        """
+        Returns the payload cached for key, calling load(path) to produce it
+        on a miss or when the file has changed since it was cached
+        """
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == mtime:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        payload = load(path)
+        self.put(key, mtime, payload)
+        return payload
+
+    def lookup(self, key):
+        """
+        Returns the payload cached for key, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, mtime, payload):
+        """
+        Stores a payload, evicting least recently used entries to stay within budget
+        """
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[1])
+            if len(payload) <= self._budget:    # Otherwise it would evict everything and still not fit
+                self._entries[key] = (mtime, payload)
+                self._size += len(payload)
+            self._evict()
+
+    def set_budget(self, budget):
+        """
+        Changes the byte budget, evicting entries if it shrank
+        """
+        with self._lock:
+            self._budget = budget
+            self._evict()
+
+    def _evict(self):
+        while self._size > self._budget:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Returns cache counters as a dictionary
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._entries), "bytes": self._size, "budget": self._budget}
+
+
+def read_file(path):
+    """
+    Reads a file and returns its raw contents
+    """
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def encode_file(path):
+    """
+    Reads a file and returns its contents as a base64 byte string
+    """
+    return base64.b64encode(read_file(path))
+
+
+def send_asset(socket, cache, key, path, encoding=None):
+    """
+    Replies with an asset file. With encoding 'raw' the reply is a JSON
+    metadata frame followed by the file bytes, sent without copying;
+    otherwise it is a single base64 frame, as older clients expect.
+    A missing file gets a lone error frame, or an empty frame in base64 mode
+    """
+    if encoding == 'raw':
+        try:
+            payload = cache.get(key + ('raw',), path, read_file)
+        except FileNotFoundError:
+            socket.send_json({"error": "not found"})
+            return
+        meta = {"encoding": "raw", "size": len(payload)}
+        socket.send_multipart([json.dumps(meta).encode(), payload], copy=False)
+    else:
+        try:
+            socket.send(cache.get(key + ('base64',), path, encode_file))
+        except FileNotFoundError:
+            socket.send(b'')
+
+
+def send_chunk(socket, cache, key, path, offset, size):
+    """
+    Replies with one chunk of an asset file: a JSON metadata frame giving
+    the total file size and the chunk's offset, then the chunk bytes.
+    A missing file gets a lone error frame
+    """
+    try:
+        payload = cache.get(key + ('raw',), path, read_file)
+    except FileNotFoundError:
+        socket.send_json({"error": "not found"})
+        return
+    chunk = memoryview(payload)[offset:offset + size]
+    meta = {"size": len(payload), "offset": offset, "length": len(chunk)}
+    socket.send_multipart([json.dumps(meta).encode(), chunk], copy=False)
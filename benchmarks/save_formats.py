@@ -0,0 +1,43 @@
+# Compares save encodings on large generated worlds: size, and encode/decode time
+
+import os
+import sys
+import json
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import save_format
+from worldgen import generate_world
+
+ZONE_COUNTS = (1000, 10000, 50000)
+REPEAT = 3
+
+FORMATS = {
+    "json (indented)": (lambda data: json.dumps(data, indent=4).encode(), json.loads),
+    "json": (lambda data: json.dumps(data).encode(), json.loads),
+    "json + zlib": (lambda data: save_format.encode(data, save_format.CODEC_JSON), save_format.decode),
+}
+if save_format.msgpack is not None:
+    FORMATS["msgpack + zlib"] = (lambda data: save_format.encode(data, save_format.CODEC_MSGPACK),
+                                 save_format.decode)
+
+
+def best_time(function, argument):
+    return min(timeit.repeat(lambda: function(argument), number=1, repeat=REPEAT))
+
+
+def main():
+    print(f"{'zones':>7}  {'format':<16}{'bytes':>12}{'encode ms':>12}{'decode ms':>12}")
+    for zone_count in ZONE_COUNTS:
+        world = generate_world(zone_count)
+        for name, (encode, decode) in FORMATS.items():
+            blob = encode(world)
+            assert decode(blob) == world
+            print(f"{zone_count:>7}  {name:<16}{len(blob):>12,}"
+                  f"{best_time(encode, world) * 1000:>12.1f}{best_time(decode, blob) * 1000:>12.1f}")
+    if save_format.msgpack is None:
+        print("msgpack is not installed; install it to benchmark the msgpack codec")
+
+
+if __name__ == "__main__":
+    main()
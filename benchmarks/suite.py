@@ -0,0 +1,214 @@
+# Scaling benchmarks over generated worlds and rosters: world load, saves, movement, character commands and assets
+#
+#   python benchmarks/suite.py [--zones 1000 10000 ...] [--characters 1000 ...] [--seed N] [--output results.json]
+#
+# The services run in this process on ipc sockets in a temporary directory, with saves and characters kept there
+# too. Results are written as JSON, one entry per measurement, to compare runs between versions, along with the
+# request timings recorded by the metrics module.
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager, redirect_stdout
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+import zmq
+import save
+import character
+import RPGGame
+import image_request
+import themes
+import worldgen
+import metrics
+from service import serve
+
+ZONE_COUNTS = (1000, 10000, 100000)
+CHARACTER_COUNTS = (1000, 10000)
+ROUND_TRIPS = 20            # Saves and loads per world
+MOVES = 10000               # Random walk length per world
+PATH_QUERIES = 200
+CHANGED_OBJECTS = 1000      # Quests changed before exporting, so saves carry a delta
+COMMANDS = 200              # Character commands of each kind per roster
+ASSET_ROUNDS = 20
+SERVICE_WORKERS = 4
+
+
+class Results:
+    """
+    Measurements of one run, each a name, the world or roster size it was
+    taken at, how many operations it covered and how long they took
+    """
+    def __init__(self):
+        self.entries = []
+
+    @contextmanager
+    def measure(self, name, size, iterations=1):
+        print(f'{name} ({size})', file=sys.stderr)
+        started = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - started
+        self.entries.append({"name": name, "size": size, "iterations": iterations, "seconds": seconds,
+                             "per_op_ms": seconds * 1000 / max(iterations, 1)})
+
+
+def start_services(directory):
+    """
+    Serves the save, character, image and theme services from worker
+    threads, on ipc sockets in directory, and points the game client at them
+    """
+    save.SAVE_DIR = os.path.join(directory, "saves")
+    os.makedirs(save.SAVE_DIR)
+    open(os.path.join(save.SAVE_DIR, save.CATALOG_FILE), "w").close()     # Skips importing legacy slots
+    save.catalog = save.SaveCatalog(save.SAVE_DIR)
+    save.catalog.load()
+    context = zmq.Context()
+    for name, handle, requests in (("SAVE", save.handle_request, save.SAVE_REQUESTS),
+                                   ("CHARACTER", character.handle_message, character.COMMANDS),
+                                   ("IMAGE", image_request.handle_request, image_request.IMAGE_REQUESTS),
+                                   ("THEME", themes.handle_request, themes.THEME_REQUESTS)):
+        address = f"ipc://{directory}/{name.lower()}"
+        setattr(RPGGame, f"{name}_ADDRESS", address)
+        threading.Thread(target=serve, args=(address, handle, SERVICE_WORKERS, context, requests),
+                         daemon=True).start()
+
+
+def bench_world(results, directory, zone_count, seed):
+    path = os.path.join(directory, f"world_{zone_count}.json")
+    with results.measure("world.generate", zone_count):
+        worldgen.write_world(path, zone_count, seed)
+    game = RPGGame.Game()
+    with results.measure("world.load.compile", zone_count):
+        game.load_game_data(path=path)
+    with results.measure("world.load.cached", zone_count):
+        game.load_game_data(path=path)
+
+    rng = random.Random(seed)
+    quests = list(game.quests.values())
+    for quest in rng.sample(quests, min(CHANGED_OBJECTS, len(quests))):
+        game.change_object(quest._object_num, {**quest.state(), "quest_progress": rng.randint(1, 10)})
+    with results.measure("game.export", zone_count, ROUND_TRIPS):
+        for _ in range(ROUND_TRIPS):
+            data = game.export_game_data()
+    pipe = game._zeromq
+    with results.measure("save.save", zone_count, ROUND_TRIPS):
+        for number in range(ROUND_TRIPS):
+            pipe.save_game_data("save", f"bench {number}", data, player="bench", quiet=True)
+    with results.measure("save.load", zone_count, ROUND_TRIPS):
+        for number in range(ROUND_TRIPS):
+            loaded = pipe.load_game_data("load", f"bench {number}", player="bench")
+    assert loaded == data, "save round trip changed the save"
+    with results.measure("game.apply_save", zone_count):
+        game.apply_save(loaded)
+    world_data = game.export_world_data()
+    with results.measure("save.world", zone_count):
+        pipe.save_game_data("save", "bench world", world_data, player="bench", quiet=True)
+        pipe.load_game_data("load", "bench world", player="bench")
+
+    location = game.adventurer.location
+    with results.measure("game.move", zone_count, MOVES):
+        for _ in range(MOVES):
+            exits = game.world.exits_of(location)
+            location = rng.choice(exits)[1] if exits else game.world.zone_ids[RPGGame.START_ZONE]
+            game.adventurer.move(location)
+            game.zones[location].get_name()
+    with results.measure("path.tables", zone_count):
+        graph = game.graph()
+    ids = list(game.world.rows)
+    pairs = [(rng.choice(ids), rng.choice(ids)) for _ in range(PATH_QUERIES)]
+    with results.measure("path.query", zone_count, PATH_QUERIES):
+        for start, target in pairs:
+            graph.path(start, target)
+    game._autosaver.stop()
+    pipe.end_connection()
+
+
+def bench_characters(results, directory, count, seed):
+    roster = os.path.join(directory, f"characters_{count}")
+    with results.measure("roster.generate", count):
+        worldgen.write_roster(roster, count, seed)
+    character.store = character.CharacterStore(roster)
+    with results.measure("roster.load", count):
+        character.store.load()
+    rng = random.Random(seed)
+    names = [character.store.list(prefix=rng.choice(worldgen.FIRST_NAMES), limit=1)["names"][0]
+             for _ in range(COMMANDS)]
+    commands = (("get_character_list", lambda name: {"prefix": name[:3], "limit": RPGGame.CHARACTER_PAGE_SIZE}),
+                ("set_active_character", lambda name: {"name": name}),
+                ("get_active_character", lambda name: {}),
+                ("grant_experience", lambda name: {"exp_points": 500}))
+    for command, params in commands:
+        with results.measure(f"character.{command}", count, COMMANDS):
+            for name in names:
+                RPGGame.send_request(command, **params(name))
+    with results.measure("character.batch", count, COMMANDS):
+        for name in names:
+            RPGGame.CharacterBatch().add("set_active_character", name=name).add(
+                "grant_experience", exp_points=500).add("get_active_character").send()
+    with results.measure("character.flush", count):
+        character.store.flush()
+
+
+def bench_assets(results):
+    pipe = RPGGame.ZeroPipe()
+    keys = [("image", os.path.splitext(filename)[0]) for filename in sorted(os.listdir("images/zone"))]
+    keys += [("theme", os.path.splitext(filename)[0]) for filename in sorted(os.listdir("themes"))]
+    with results.measure("asset.fetch.cold", len(keys), len(keys)):
+        pipe.get_assets(keys)
+    with results.measure("asset.fetch.batch", len(keys), ASSET_ROUNDS * len(keys)):
+        for _ in range(ASSET_ROUNDS):
+            pipe.get_assets(keys)
+    with results.measure("asset.fetch.single", len(keys), ASSET_ROUNDS * len(keys)):
+        for _ in range(ASSET_ROUNDS):
+            for key in keys:
+                pipe.get_asset(key)
+    pipe.end_connection()
+
+
+def revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=ROOT).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the game and services on generated worlds and rosters")
+    parser.add_argument("--zones", type=int, nargs="*", default=ZONE_COUNTS)
+    parser.add_argument("--characters", type=int, nargs="*", default=CHARACTER_COUNTS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)                  # The asset services read images and themes relative to the repository
+    results = Results()
+    with tempfile.TemporaryDirectory() as directory, redirect_stdout(io.StringIO()):
+        start_services(directory)
+        bench_assets(results)
+        for count in args.characters:
+            bench_characters(results, directory, count, args.seed)
+        for zone_count in args.zones:
+            bench_world(results, directory, zone_count, args.seed)
+
+    report = {"revision": revision(), "python": platform.python_version(), "platform": platform.platform(),
+              "timestamp": time.time(), "seed": args.seed, "results": results.entries,
+              "metrics": metrics.registry.report()}
+    with open(args.output, "w") as outfile:
+        json.dump(report, outfile, indent=4)
+    print(f"{'benchmark':<32}{'size':>9}{'ops':>8}{'total ms':>12}{'ms/op':>10}")
+    for entry in results.entries:
+        print(f"{entry['name']:<32}{entry['size']:>9}{entry['iterations']:>8}"
+              f"{entry['seconds'] * 1000:>12.1f}{entry['per_op_ms']:>10.3f}")
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
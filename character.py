@@ -1,10 +1,38 @@
 import json
 import os
+import secrets
+import threading
 import time
+from bisect import bisect_left, bisect_right, insort
+from contextlib import nullcontext
+from itertools import accumulate
+from urllib.parse import quote
+import metrics
+from service import serve, worker_count
 
-# File name for character data storage
+# Directory holding one JSON file per character, plus the name index
+CHARACTER_DIR = "characters"
+INDEX_FILE = "index.log"
+
+# Legacy single-file roster, imported into CHARACTER_DIR on first start
 CHARACTER_DATA_FILE = "character_data.json"
 
+# Address the microservice listens on, and its default number of worker threads
+CHARACTER_ADDRESS = "tcp://*:5558"
+WORKER_COUNT = 8
+
+# Seconds a session may go unused before it is dropped, and between sweeps for such sessions
+SESSION_IDLE_TIMEOUT = 4 * 3600
+SESSION_SWEEP_INTERVAL = 60
+
+# Seconds between write-behind flushes of modified characters
+FLUSH_INTERVAL = 5
+
+# Default and largest page for get_character_list, and how many index entries one page may scan
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 500
+MAX_SCAN = 5000
+
 # Job-based stat increments per level
 JOB_STAT_INCREMENTS = {
     "Warrior": {"hp": 10, "mp": 5, "physical_attack": 3, "magical_attack": 1, "defense": 2, "hit_rate": 1},
@@ -12,22 +40,72 @@ JOB_STAT_INCREMENTS = {
     "Rogue": {"hp": 7, "mp": 7, "physical_attack": 2, "magical_attack": 2, "defense": 2, "hit_rate": 3}
 }
 
-# Generate leveling table for levels 1-40
-def generate_leveling_table():
+# Stat increments for jobs missing from JOB_STAT_INCREMENTS
+DEFAULT_STAT_INCREMENTS = {"hp": 5, "mp": 5, "physical_attack": 1, "magical_attack": 1, "defense": 1, "hit_rate": 1}
+STAT_NAMES = ("hp", "mp", "physical_attack", "magical_attack", "defense", "hit_rate")
+
+# Experience curve: level N needs BASE_EXP * EXP_GROWTH ** (N - 1) to reach N + 1, up to LEVEL_CAP
+BASE_EXP = 1000
+EXP_GROWTH = 1.2
+LEVEL_CAP = 40
+
+# Generate leveling table for levels 1-max_level
+def generate_leveling_table(base_exp=BASE_EXP, growth=EXP_GROWTH, max_level=LEVEL_CAP):
     leveling_table = {}
-    base_exp = 1000
-    for level in range(1, 41):
-        leveling_table[level] = int(base_exp * (1.2 ** (level - 1)))
+    for level in range(1, max_level + 1):
+        leveling_table[level] = int(base_exp * (growth ** (level - 1)))
     return leveling_table
 
-LEVELING_TABLE = generate_leveling_table()
+
+class LevelingCurve:
+    """
+    Precomputed leveling data for one experience curve.
+
+    cumulative[L - 1] is the experience needed to go from level 1 to level L,
+    and stat_totals[job][L - 1] is the stat vector (in STAT_NAMES order) gained
+    over the same span. Resolving any amount of experience is then a binary
+    search plus one vector difference, whatever the number of levels gained.
+    """
+    def __init__(self, base_exp=BASE_EXP, growth=EXP_GROWTH, max_level=LEVEL_CAP):
+        self.max_level = max_level
+        self.table = generate_leveling_table(base_exp, growth, max_level)
+        self.cumulative = list(accumulate((self.table[level] for level in range(1, max_level)), initial=0))
+        self.stat_totals = {job: self._stat_totals(increments) for job, increments in JOB_STAT_INCREMENTS.items()}
+        self.default_stat_totals = self._stat_totals(DEFAULT_STAT_INCREMENTS)
+
+    def _stat_totals(self, increments):
+        vector = [increments[stat] for stat in STAT_NAMES]
+        return [tuple(value * levels for value in vector) for levels in range(self.max_level)]
+
+    def resolve(self, level, experience):
+        """Return the (level, experience) reached by spending experience from the given level, never below it."""
+        if level >= self.max_level or experience < 0:
+            return level, experience
+        total = self.cumulative[level - 1] + experience
+        new_level = bisect_right(self.cumulative, total)
+        return new_level, total - self.cumulative[new_level - 1]
+
+    def apply(self, character):
+        """Level the character as far as its experience allows. Returns the number of levels gained."""
+        old_level = character["level"]
+        new_level, experience = self.resolve(old_level, character["experience"])
+        if new_level == old_level:
+            return 0
+        totals = self.stat_totals.get(character["job"], self.default_stat_totals)
+        before, after = totals[old_level - 1], totals[new_level - 1]
+        updated = {stat: character[stat] + end - start for stat, start, end in zip(STAT_NAMES, before, after)}
+        updated.update(level=new_level, experience=experience, experienceToNextLevel=self.table[new_level])
+        character.update(updated)      # Only once everything is computed, so a failure leaves the record intact
+        return new_level - old_level
+
+
+LEVELING = LevelingCurve()
+LEVELING_TABLE = LEVELING.table
 
 # Data management functions
 def load_character_data():
-    """Load the list of characters from the JSON file."""
+    """Load the legacy list of characters from the JSON file."""
     if not os.path.exists(CHARACTER_DATA_FILE):
-        with open(CHARACTER_DATA_FILE, "w") as f:
-            json.dump([], f)
         return []
     with open(CHARACTER_DATA_FILE, "r") as f:
         content = f.read().strip()
@@ -35,45 +113,341 @@ def load_character_data():
             return []
         return json.loads(content)
 
-def save_character_data(data):
-    """Save the list of characters to the JSON file."""
-    with open(CHARACTER_DATA_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+def atomic_write(path, content, sync=False):
+    """Replace path with content via a temporary file and rename, so readers never see a partial write."""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        f.write(content)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def fsync_directory(path):
+    """Force directory entries (renames, new files) to disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def character_summary(character):
+    """Fields kept in the name index so listings never decode stat blocks."""
+    return {"name": character["name"], "job": character["job"], "level": character["level"]}
+
+
+class CharacterStore:
+    """
+    Character storage laid out as one JSON file per character in CHARACTER_DIR.
+
+    A name index keyed by lowercased name is loaded once at startup from an
+    append-only log and compacted when the log grows past twice the roster.
+    Full records are loaded on first use, mutated in place and written back
+    by flush() once they are marked dirty.
+
+    The store is shared by every worker thread. The index is guarded by an
+    internal lock, and callers hold lock(name) around any read-modify-write of
+    a record so concurrent sessions cannot interleave updates to it.
+    """
+    def __init__(self, directory=CHARACTER_DIR, flush_interval=FLUSH_INTERVAL):
+        self._directory = directory
+        self._index_path = os.path.join(directory, INDEX_FILE)
+        self._index = {}
+        self._flushed = {}              # Index entries as last written, for compaction
+        self._sorted = []               # Index keys in name order
+        self._by_job = {}               # Index keys in name order, per job
+        self._records = {}
+        self._dirty = {}                # Ordered set of modified keys
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._log_entries = 0
+        self._flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+
+    def load(self):
+        """Load the name index, importing the legacy character_data.json on first run."""
+        self._index = {}
+        self._flushed = {}
+        self._sorted = []
+        self._by_job = {}
+        self._records = {}
+        self._dirty.clear()
+        self._log_entries = 0
+        if not os.path.isdir(self._directory):
+            os.makedirs(self._directory)
+            for character in load_character_data():
+                self.add(character)
+            self.flush(sync=True)
+            return
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "r") as f:
+                for line in f:
+                    try:
+                        summary = json.loads(line)
+                    except ValueError:  # Torn final line from a crash mid-append
+                        continue
+                    self._index[summary["name"].lower()] = summary
+                    self._log_entries += 1
+        self._flushed = dict(self._index)
+        self._sorted = sorted(self._index)
+        for key in self._sorted:
+            self._by_job.setdefault(self._index[key]["job"], []).append(key)
+
+    def record_path(self, key):
+        return os.path.join(self._directory, quote(key, safe="") + ".json")
+
+    def lock(self, name):
+        """Return the lock serializing updates to one character."""
+        key = name.lower()
+        with self._lock:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    def list(self, prefix="", job=None, min_level=None, max_level=None, cursor=None, limit=PAGE_SIZE):
+        """
+        Return one page of names in alphabetical order, and the cursor to pass
+        for the next page (None on the last page). The prefix and job select a
+        range of the sorted name indexes; level filters are checked against the
+        index entries, scanning at most MAX_SCAN of them per page.
+        """
+        prefix = prefix.lower()
+        names = []
+        with self._lock:
+            keys = self._by_job.get(job, []) if job else self._sorted
+            if cursor and cursor.lower() >= prefix:
+                position = bisect_right(keys, cursor.lower())
+            else:
+                position = bisect_left(keys, prefix)
+            end = min(len(keys), position + MAX_SCAN)
+            while position < end and len(names) < limit:
+                key = keys[position]
+                if not key.startswith(prefix):
+                    return {"status": "success", "names": names, "next_cursor": None}
+                position += 1
+                level = self._index[key]["level"]
+                if (min_level is None or level >= min_level) and (max_level is None or level <= max_level):
+                    names.append(self._index[key]["name"])
+            more = position < len(keys) and keys[position].startswith(prefix)
+            next_cursor = keys[position - 1] if more else None
+        return {"status": "success", "names": names, "next_cursor": next_cursor}
+
+    def get(self, name):
+        if not name:
+            return None
+        key = name.lower()
+        with self._lock:
+            if key not in self._records:
+                if key not in self._index:
+                    return None
+                try:
+                    with open(self.record_path(key), "r") as f:
+                        self._records[key] = json.load(f)
+                except FileNotFoundError:   # Indexed but never written, e.g. after a crash mid-flush
+                    return None
+            return self._records[key]
+
+    def add(self, character):
+        """Insert a new character. Returns False if the name is already taken."""
+        key = character["name"].lower()
+        with self._lock:
+            if key in self._index:
+                return False
+            self._records[key] = character
+            self._index[key] = character_summary(character)
+            self._dirty[key] = None
+            insort(self._sorted, key)
+            insort(self._by_job.setdefault(character["job"], []), key)
+        return True
+
+    def mark_dirty(self, name):
+        key = name.lower()
+        with self._lock:
+            self._index[key] = character_summary(self._records[key])
+            self._dirty[key] = None
+
+    def restore(self, name, character):
+        """Put back a record's earlier contents, or drop it if character is None and it was never flushed."""
+        key = name.lower()
+        if character is None:
+            with self._lock:
+                self._records.pop(key, None)
+                summary = self._index.pop(key, None)
+                self._dirty.pop(key, None)
+                if summary is not None:
+                    for keys in (self._sorted, self._by_job[summary["job"]]):
+                        del keys[bisect_left(keys, key)]
+            return
+        record = self.get(name)
+        record.clear()
+        record.update(character)
+        self.mark_dirty(name)
+
+    def time_until_flush(self):
+        """Seconds until the next write-behind flush is due."""
+        return max(0.0, self._last_flush + self._flush_interval - time.monotonic())
+
+    def flush(self, sync=False):
+        """Write modified characters to disk. Returns the number of dirty records written."""
+        with self._flush_lock:
+            with self._lock:
+                dirty = list(self._dirty)
+                self._dirty.clear()
+            summaries = []
+            for key in dirty:
+                with self.lock(key):
+                    record = self._records.get(key)
+                    if record is None:  # Created by a transaction that rolled back
+                        continue
+                    content = json.dumps(record, indent=4)
+                    summary = character_summary(record)
+                atomic_write(self.record_path(key), content, sync)
+                summaries.append(summary)
+                with self._lock:
+                    self._flushed[key] = summary
+            with self._lock:
+                compact = self._log_entries + len(summaries) > 2 * len(self._flushed) + 1
+            if compact:
+                self.compact_index(sync)
+            elif summaries:
+                with open(self._index_path, "a") as f:
+                    for summary in summaries:
+                        f.write(json.dumps(summary) + "\n")
+                    if sync:
+                        f.flush()
+                        os.fsync(f.fileno())
+                self._log_entries += len(summaries)
+            if sync:
+                fsync_directory(self._directory)
+            self._last_flush = time.monotonic()
+            return len(summaries)
+
+    def compact_index(self, sync=False):
+        """Rewrite the index log with one entry per character written to disk."""
+        with self._lock:
+            content = "".join(json.dumps(summary) + "\n" for summary in self._flushed.values())
+        atomic_write(self._index_path, content, sync)
+        self._log_entries = content.count("\n")
+
+
+class Session:
+    """Per-client state, so each connected player has their own active character."""
+    def __init__(self, active=None, transaction=None):
+        self.active = active
+        self.transaction = transaction
+        self.last_used = time.monotonic()
+
+
+class Transaction:
+    """
+    Runs a batch of commands so that they either all take effect or none do.
+
+    Commands run against a copy of the caller's session. Each character the
+    batch touches stays locked until commit or rollback, and its contents are
+    saved when first locked so rollback can put them back. Transactions are
+    serialized among themselves so two of them never wait on each other's locks.
+    """
+    _serial = threading.Lock()
+
+    def __init__(self, session):
+        self._session = session
+        self.session = Session(session.active, self)
+        self._locks = {}
+        self._saved = {}
+
+    def __enter__(self):
+        Transaction._serial.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        for lock in self._locks.values():
+            lock.release()
+        Transaction._serial.release()
+
+    def lock(self, name):
+        """Lock a character for the rest of the transaction, remembering its current contents."""
+        key = name.lower()
+        if key not in self._locks:
+            lock = store.lock(key)
+            lock.acquire()
+            self._locks[key] = lock
+            record = store.get(key)
+            self._saved[key] = dict(record) if record is not None else None
+        return nullcontext()
+
+    def commit(self):
+        self._session.active = self.session.active
+
+    def rollback(self):
+        for key, character in self._saved.items():
+            store.restore(key, character)
+
+
+store = CharacterStore()
+
+# Sessions by token. Requests without a token share the None session.
+_sessions = {None: Session()}
+_sessions_lock = threading.Lock()
+_last_sweep = time.monotonic()
+
+def expire_sessions(now):
+    """Drop sessions unused for SESSION_IDLE_TIMEOUT. Called with _sessions_lock held."""
+    global _last_sweep
+    _last_sweep = now
+    expired = [token for token, session in _sessions.items()
+               if token is not None and now - session.last_used > SESSION_IDLE_TIMEOUT]
+    for token in expired:
+        del _sessions[token]
+
+def open_session():
+    token = secrets.token_hex(16)
+    now = time.monotonic()
+    with _sessions_lock:
+        if now - _last_sweep > SESSION_SWEEP_INTERVAL:
+            expire_sessions(now)
+        _sessions[token] = Session()
+    return token
+
+def close_session(token):
+    with _sessions_lock:
+        return token is not None and _sessions.pop(token, None) is not None
+
+def get_session(token):
+    """Return the session for a token, or None if it is unknown or has expired."""
+    now = time.monotonic()
+    with _sessions_lock:
+        session = _sessions.get(token)
+        if session is None or token is None:
+            return session
+        if now - session.last_used > SESSION_IDLE_TIMEOUT:
+            del _sessions[token]
+            return None
+        session.last_used = now
+        return session
+
+def character_lock(session, name):
+    """Lock guarding a character for this request, held to the end of a transaction."""
+    if session.transaction is not None:
+        return session.transaction.lock(name)
+    return store.lock(name)
 
 def update_active_character(updated_character):
-    """Update the active character in the JSON file."""
-    data = load_character_data()
-    for idx, char in enumerate(data):
-        if char["name"].lower() == updated_character["name"].lower():
-            data[idx] = updated_character
-            break
-    save_character_data(data)
-
-# Global variable for active character
-_active_character_name = None
-
-def set_active_character(name):
-    """Set the active character by name."""
-    global _active_character_name
-    _active_character_name = name
-
-def get_active_character():
-    """Return the active character object."""
-    data = load_character_data()
-    for char in data:
-        if char["name"].lower() == _active_character_name.lower():
-            return char
-    return None
+    """Mark the active character as modified so the next flush persists it."""
+    store.mark_dirty(updated_character["name"])
+
+def set_active_character(session, name):
+    """Set the session's active character by name."""
+    session.active = name
+
+def get_active_character(session):
+    """Return the session's active character object."""
+    return store.get(session.active)
 
 # Microservice operations (non-interactive)
-def create_new_character(name, job):
-    """Create a new character if name is unique and job is valid."""
-    data = load_character_data()
-    if any(char["name"].lower() == name.lower() for char in data):
-        return {"status": "error", "message": "Name already exists"}
-    if job not in ["Warrior", "Mage", "Rogue"]:
-        return {"status": "error", "message": "Invalid job"}
-    character = {
+def new_character(name, job):
+    """Return the record of a level 1 character."""
+    return {
         "name": name,
         "job": job,
         "level": 1,
@@ -86,8 +460,16 @@ def create_new_character(name, job):
         "defense": 5,
         "hit_rate": 5
     }
-    data.append(character)
-    save_character_data(data)
+
+def create_new_character(name, job):
+    """Create a new character if name is unique and job is valid."""
+    if not name:
+        return {"status": "error", "message": "Invalid name"}
+    if job not in ["Warrior", "Mage", "Rogue"]:
+        return {"status": "error", "message": "Invalid job"}
+    character = new_character(name, job)
+    if not store.add(character):
+        return {"status": "error", "message": "Name already exists"}
     return {"status": "success", "character": character}
 
 # def update_character_name(new_name):
@@ -125,9 +507,9 @@ def create_new_character(name, job):
 #     else:
 #         print("Name change cancelled.")
 
-def view_character():
+def view_character(session):
     """Display the active character's status."""
-    active_char = get_active_character()
+    active_char = get_active_character(session)
     if active_char:
         print("\n--- Active Character Status ---")
         for key, value in active_char.items():
@@ -135,131 +517,210 @@ def view_character():
     else:
         print("No active character selected.")
 
-def save_current_character():
+def save_current_character(session):
     """Explicitly save the current active character (if there are unsaved changes in memory)."""
-    active_char = get_active_character()
+    active_char = get_active_character(session)
     if active_char:
         update_active_character(active_char)
+        store.flush(sync=True)
         print("Character saved successfully!")
     else:
         print("No active character to save.")
 
-def add_experience(exp_points):
+def add_experience(session, exp_points):
     """Add experience to the active character."""
-    active_char = get_active_character()
-    if not active_char:
+    if exp_points < 0:
+        return {"status": "error", "message": "Experience points cannot be negative"}
+    name = session.active
+    if not name:
         return {"status": "error", "message": "No active character"}
-    active_char["experience"] += exp_points
-    update_active_character(active_char)
-    return {"status": "success", "character": active_char}
+    with character_lock(session, name):
+        active_char = store.get(name)
+        if not active_char:
+            return {"status": "error", "message": "No active character"}
+        active_char["experience"] += exp_points
+        update_active_character(active_char)
+        return {"status": "success", "character": dict(active_char)}
 
-def level_up():
+def level_up(session):
     """Level up the active character if enough experience is available."""
-    active_char = get_active_character()
-    if not active_char:
+    name = session.active
+    if not name:
         return {"status": "error", "message": "No active character"}
-    leveled = False
-    while active_char["level"] < 40:
-        current_level = active_char["level"]
-        required_exp = LEVELING_TABLE[current_level]
-        if active_char["experience"] < required_exp:
-            break
-        active_char["level"] += 1
-        active_char["experience"] -= required_exp
-        active_char["experienceToNextLevel"] = LEVELING_TABLE[active_char["level"]]
-        increments = JOB_STAT_INCREMENTS.get(active_char["job"], {"hp": 5, "mp": 5, "physical_attack": 1, "magical_attack": 1, "defense": 1, "hit_rate": 1})
-        active_char["hp"] += increments["hp"]
-        active_char["mp"] += increments["mp"]
-        active_char["physical_attack"] += increments["physical_attack"]
-        active_char["magical_attack"] += increments["magical_attack"]
-        active_char["defense"] += increments["defense"]
-        active_char["hit_rate"] += increments["hit_rate"]
-        leveled = True
-    update_active_character(active_char)
-    if leveled:
-        return {"status": "success", "character": active_char}
-    else:
-        return {"status": "error", "message": "Not enough experience"}
+    with character_lock(session, name):
+        active_char = store.get(name)
+        if not active_char:
+            return {"status": "error", "message": "No active character"}
+        leveled = LEVELING.apply(active_char)
+        update_active_character(active_char)
+        if leveled:
+            return {"status": "success", "character": dict(active_char)}
+        else:
+            return {"status": "error", "message": "Not enough experience"}
+
+def grant_experience(session, exp_points):
+    """Add experience to the active character and apply every level it unlocks in one update."""
+    if exp_points < 0:
+        return {"status": "error", "message": "Experience points cannot be negative"}
+    name = session.active
+    if not name:
+        return {"status": "error", "message": "No active character"}
+    with character_lock(session, name):
+        active_char = store.get(name)
+        if not active_char:
+            return {"status": "error", "message": "No active character"}
+        active_char["experience"] += exp_points
+        levels = LEVELING.apply(active_char)
+        update_active_character(active_char)
+        return {"status": "success", "levels_gained": levels, "character": dict(active_char)}
+
+# Request dispatch
+def handle_open_session(session, request):
+    return {"status": "success", "session": open_session()}
 
-# File handling functions for communication
-def write_response(response):
-    """Write the response to response.txt."""
-    with open("response.txt", "w") as f:
-        f.write(response)
+def handle_close_session(session, request):
+    if close_session(request.get("session")):
+        return {"status": "success"}
+    return {"status": "error", "message": "Unknown session"}
 
-def read_request():
-    """Read the request from request.txt."""
+def handle_get_character_list(session, request):
     try:
-        with open("request.txt", "r") as f:
-            return f.read().strip()
-    except FileNotFoundError:
-        return None
+        limit = min(int(request.get("limit", PAGE_SIZE)), MAX_PAGE_SIZE)
+        min_level = request.get("min_level")
+        max_level = request.get("max_level")
+        min_level = int(min_level) if min_level is not None else None
+        max_level = int(max_level) if max_level is not None else None
+    except (TypeError, ValueError):
+        return {"status": "error", "message": "Invalid listing parameters"}
+    return store.list(prefix=request.get("prefix") or "", job=request.get("job"), min_level=min_level,
+                      max_level=max_level, cursor=request.get("cursor"), limit=max(limit, 1))
+
+def handle_create_new_character(session, request):
+    name = request.get("name")
+    if not name:
+        return {"status": "error", "message": "Invalid name"}
+    with character_lock(session, name):
+        return create_new_character(name, request.get("job"))
+
+def handle_set_active_character(session, request):
+    name = request.get("name")
+    if store.get(name):
+        set_active_character(session, name)
+        return {"status": "success"}
+    return {"status": "error", "message": "Character not found"}
+
+def handle_get_active_character(session, request):
+    name = session.active
+    character = store.get(name)
+    if character:
+        with character_lock(session, name):
+            return dict(character)
+    return {"status": "error", "message": "No active character"}
+
+def handle_add_experience(session, request):
+    return add_experience(session, int(request.get("exp_points", 0)))
+
+def handle_level_up(session, request):
+    return level_up(session)
+
+def handle_grant_experience(session, request):
+    return grant_experience(session, int(request.get("exp_points", 0)))
+
+def handle_flush(session, request):
+    """Write pending changes and fsync the character files."""
+    return {"status": "success", "flushed": store.flush(sync=True)}
+
+def handle_stats(session, request):
+    """Return the service's metrics, after applying any switches in the request."""
+    return {"status": "success", "metrics": metrics.handle_stats(request)}
+
+def handle_batch(session, request):
+    """
+    Run several commands in order and return their results. With
+    transaction=true the batch stops at the first error and rolls back.
+    """
+    commands = request.get("commands") or []
+    excluded = TRANSACTION_EXCLUDED if request.get("transaction") else BATCH_EXCLUDED
+    for command in commands:
+        if command.get("command") in excluded:
+            return {"status": "error", "message": f"{command.get('command')} is not allowed in this batch"}
+    if not request.get("transaction"):
+        return {"status": "success", "results": [dispatch(session, command) for command in commands]}
+    results = []
+    with Transaction(session) as transaction:
+        try:
+            for command in commands:
+                result = dispatch(transaction.session, command)
+                results.append(result)
+                if isinstance(result, dict) and result.get("status") == "error":
+                    transaction.rollback()
+                    return {"status": "error", "message": "Transaction rolled back", "results": results}
+        except Exception as error:
+            transaction.rollback()
+            return {"status": "error", "message": f"Transaction rolled back: {error}", "results": results}
+        transaction.commit()
+    return {"status": "success", "results": results}
 
-def clear_request():
-    """Remove request.txt after processing."""
+COMMANDS = {
+    "open_session": handle_open_session,
+    "close_session": handle_close_session,
+    "get_character_list": handle_get_character_list,
+    "create_new_character": handle_create_new_character,
+    "set_active_character": handle_set_active_character,
+    "get_active_character": handle_get_active_character,
+    "add_experience": handle_add_experience,
+    "level_up": handle_level_up,
+    "grant_experience": handle_grant_experience,
+    "flush": handle_flush,
+    "stats": handle_stats,
+    "batch": handle_batch
+}
+
+# Commands that cannot appear inside a batch, and inside a transactional batch
+BATCH_EXCLUDED = {"batch", "open_session", "close_session"}
+TRANSACTION_EXCLUDED = BATCH_EXCLUDED | {"flush"}
+
+def dispatch(session, request):
+    """Run one command for the given session."""
+    command = request.get("command")
+    handler = COMMANDS.get(command)
+    if handler is None:
+        return {"status": "error", "message": "Unknown command"}
+    with metrics.timed(f"command.{command}"):
+        return handler(session, request)
+
+def handle_request(request):
+    """Dispatch a request dictionary to its command handler within the caller's session."""
+    session = get_session(request.get("session"))
+    if session is None:
+        return {"status": "error", "message": "Unknown session"}
+    return dispatch(session, request)
+
+def handle_message(socket, request):
+    """Worker entry point: reply to one request, with an error reply in the usual shape if it fails."""
     try:
-        os.remove("request.txt")
-    except FileNotFoundError:
-        pass
+        response = handle_request(request)
+    except Exception as error:
+        print(f'Request failed: {error!r}')
+        response = {"status": "error", "message": f"Request failed: {error}"}
+    socket.send_json(response)
 
-def request_available():
-    """Check if a request is available."""
-    return os.path.exists("request.txt")
-
-def parse_request(request):
-    """Parse the request string into command and parameters."""
-    parts = request.split()
-    command = parts[0]
-    params = {}
-    for part in parts[1:]:
-        if "=" in part:
-            key, value = part.split("=", 1)
-            params[key] = value
-    return command, params
+def flush_periodically():
+    """Write-behind flusher thread."""
+    while True:
+        time.sleep(store.time_until_flush())
+        if store.time_until_flush() == 0:
+            store.flush()
 
 # Main microservice loop
 if __name__ == "__main__":
+    store.load()
+    threading.Thread(target=flush_periodically, daemon=True).start()
     print("Character Microservice is running. Waiting for requests...")
-    while True:
-        if request_available():
-            request = read_request()
-            clear_request()
-            command, params = parse_request(request)
-            if command == "get_character_list":
-                data = load_character_data()
-                names = [char["name"] for char in data]
-                response = json.dumps(names)
-            elif command == "create_new_character":
-                name = params.get("name")
-                job = params.get("job")
-                result = create_new_character(name, job)
-                response = json.dumps(result)
-            elif command == "set_active_character":
-                name = params.get("name")
-                data = load_character_data()
-                if any(char["name"].lower() == name.lower() for char in data):
-                    set_active_character(name)
-                    response = json.dumps({"status": "success"})
-                else:
-                    response = json.dumps({"status": "error", "message": "Character not found"})
-            elif command == "get_active_character":
-                character = get_active_character()
-                if character:
-                    response = json.dumps(character)
-                else:
-                    response = json.dumps({"status": "error", "message": "No active character"})
-            # elif command == "update_character_name":
-            #     new_name = params.get("new_name")
-            #     # result = update_character_name(new_name)
-            #     response = json.dumps(result)
-            elif command == "add_experience":
-                exp_points = int(params.get("exp_points", 0))
-                result = add_experience(exp_points)
-                response = json.dumps(result)
-            elif command == "level_up":
-                result = level_up()
-                response = json.dumps(result)
-            else:
-                response = json.dumps({"status": "error", "message": "Unknown command"})
-            write_response(response)
-        time.sleep(1)  # Prevent excessive CPU usage
\ No newline at end of file
+    try:
+        # Set to listen on port 5558
+        serve(CHARACTER_ADDRESS, handle_message, worker_count(WORKER_COUNT), requests=COMMANDS)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        store.flush(sync=True)
@@ -1,31 +1,36 @@
 # Image microservice
 
-import time
-import zmq
-import base64
+import metrics
+from asset_cache import AssetCache, send_asset
+from service import serve, worker_count
 
-context = zmq.Context()             # Sets up the environment so that we are able to begin
-socket = context.socket(zmq.REP)    # Reply socket type
-socket.bind("tcp://*:5555")         # Set to listen on port 5555
+IMAGE_CACHE_BUDGET = 64 * 1024 * 1024   # Bytes of images kept in memory
+IMAGE_WORKERS = 4
+IMAGE_REQUESTS = ("stats",)             # Requests other than plain image fetches
 
+cache = AssetCache(IMAGE_CACHE_BUDGET)
 
-def retrieve_image(type, name):
+
+def image_path(type, name):
     """
-    Retrieves image and returns as byte string
+    Returns the file path of an image
     """
-    image = open('images/' + type + '/' + name.lower().strip() + '.jpg', 'rb').read()
-    byte_image = base64.b64encode(image)
-    return byte_image
+    return 'images/' + type + '/' + name.lower().strip() + '.jpg'
+
 
+def handle_request(socket, data):
+    """
+    Replies to one request with an image, or the cache counters and metrics
+    """
+    if data.get('request') == 'stats':
+        socket.send_json({**cache.stats(), "metrics": metrics.handle_stats(data)})
+        return
 
-while True:
-    data = socket.recv_json()  # Where the message will be held
-    response = None
+    print('Request received')
+    key = (data['type'], data['name'].lower().strip())
+    send_asset(socket, cache, key, image_path(data['type'], data['name']), data.get('encoding'))
+    print('Image delivered')
 
-    if data:
-        print('Request received')
-        response = retrieve_image(data['type'], data['name'])
-        socket.send(response)
-        print('Image delivered')
 
-        time.sleep(1)
+if __name__ == "__main__":
+    serve("tcp://*:5555", handle_request, worker_count(IMAGE_WORKERS), requests=IMAGE_REQUESTS)     # Set to listen on port 5555
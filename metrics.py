@@ -0,0 +1,247 @@
+# Instrumentation shared by the game and the microservices: latency histograms, counters and profiling
+
+import time
+import cProfile
+import threading
+import tracemalloc
+from bisect import bisect_left
+from contextlib import nullcontext
+
+METRICS_ENABLED = True      # Whether timers and counters record from startup; see configure()
+LATENCY_BOUNDS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)     # Bucket ms
+PROFILE_ENTRIES = 20        # Functions listed from a profile, by cumulative time
+TRACE_FRAMES = 1            # Stack frames kept per traced allocation
+TRACE_ENTRIES = 10          # Source lines listed from a memory trace, by size
+
+NO_TIMER = nullcontext()
+_local = threading.local()
+
+
+class Histogram:
+    """
+    Latency histogram over LATENCY_BOUNDS, plus an overflow bucket. Percentiles
+    are interpolated within the bucket they fall in, whose ends are narrowed
+    to the smallest and largest latency seen
+    """
+    __slots__ = ("counts", "total", "minimum", "maximum")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BOUNDS) + 1)
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = 0.0
+
+    def add(self, ms):
+        self.counts[bisect_left(LATENCY_BOUNDS, ms)] += 1
+        self.total += ms
+        self.minimum = ms if self.minimum is None or ms < self.minimum else self.minimum
+        self.maximum = ms if ms > self.maximum else self.maximum
+
+    def percentile(self, fraction):
+        rank = fraction * sum(self.counts)
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = max(LATENCY_BOUNDS[bucket - 1] if bucket else 0.0, self.minimum)
+                high = min(LATENCY_BOUNDS[bucket], self.maximum) if bucket < len(LATENCY_BOUNDS) else self.maximum
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return self.maximum
+
+    def summary(self):
+        count = sum(self.counts)
+        bounds = [str(bound) for bound in LATENCY_BOUNDS] + ["inf"]
+        return {"count": count, "mean_ms": self.total / count if count else 0.0, "min_ms": self.minimum or 0.0,
+                "max_ms": self.maximum, "p50_ms": self.percentile(0.5), "p90_ms": self.percentile(0.9),
+                "p99_ms": self.percentile(0.99),
+                "buckets": {bound: count for bound, count in zip(bounds, self.counts) if count}}
+
+
+class Registry:
+    """
+    The process's histograms and counters, shared by every thread. While
+    profiling, the outermost timed section of a thread also runs under the
+    process's cProfile profiler, one thread at a time: Python 3.12 and later
+    allow only one active profiler per process
+    """
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.profiling = False
+        self._histograms = {}
+        self._counters = {}
+        self._profiler = None
+        self._profile_lock = threading.Lock()       # Held by the thread running under the profiler
+        self._lock = threading.Lock()
+
+    def observe(self, name, ms):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.add(ms)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def start_profile(self):
+        """
+        Enables the profiler for the calling thread and returns True, or
+        returns False if another thread or profiling tool is using it
+        """
+        if not self._profile_lock.acquire(blocking=False):
+            return False
+        if self._profiler is None:
+            self._profiler = cProfile.Profile()
+        try:
+            self._profiler.enable()
+        except ValueError:      # Another profiler is active in the process
+            self._profile_lock.release()
+            return False
+        return True
+
+    def stop_profile(self):
+        self._profiler.disable()
+        self._profile_lock.release()
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._counters = {}
+            if self._profiler is not None:
+                self._profiler.clear()
+
+    def profile_report(self):
+        """
+        Returns the functions that took the most cumulative time in the profile
+        """
+        profiler = self._profiler
+        profiler.snapshot_stats()       # Reads the profile in place, without stopping a thread using it
+        totals = {function: (calls, own, cumulative)
+                  for function, (_, calls, own, cumulative, _) in profiler.stats.items()}
+        entries = sorted(totals.items(), key=lambda item: item[1][2], reverse=True)[:PROFILE_ENTRIES]
+        return [{"function": f"{path}:{line}({function})", "calls": calls, "own_ms": own * 1000,
+                 "cumulative_ms": cumulative * 1000}
+                for (path, line, function), (calls, own, cumulative) in entries]
+
+    def report(self):
+        """
+        Returns everything recorded, in a form that can be sent as JSON
+        """
+        with self._lock:
+            timers = {name: histogram.summary() for name, histogram in sorted(self._histograms.items())}
+            counters = dict(sorted(self._counters.items()))
+        report = {"enabled": self.enabled, "profiling": self.profiling, "tracing_memory": tracemalloc.is_tracing(),
+                  "timers": timers, "counters": counters}
+        if self._profiler is not None:
+            report["profile"] = self.profile_report()
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            lines = tracemalloc.take_snapshot().statistics("lineno")[:TRACE_ENTRIES]
+            report["memory"] = {"current_bytes": current, "peak_bytes": peak,
+                                "top": [{"location": str(line.traceback), "bytes": line.size, "blocks": line.count}
+                                        for line in lines]}
+        return report
+
+
+registry = Registry()
+
+
+class Timer:
+    """
+    Times a section into a histogram. Used through timed()
+    """
+    __slots__ = ("name", "started", "profiled", "profiling")
+
+    def __init__(self, name):
+        self.name = name
+        self.profiled = registry.profiling
+        self.profiling = False
+
+    def __enter__(self):
+        if self.profiled:                       # Only the outermost section of a thread starts the profiler
+            depth = getattr(_local, "depth", 0)
+            _local.depth = depth + 1
+            if depth == 0:
+                self.profiling = registry.start_profile()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        ms = (time.perf_counter() - self.started) * 1000
+        if self.profiled:
+            _local.depth -= 1
+            if self.profiling:
+                registry.stop_profile()
+        registry.observe(self.name, ms)
+        if exc_info[0] is not None:
+            registry.count(self.name + ".errors")
+
+
+def timed(name):
+    """
+    Returns a context manager recording how long its block takes under
+    name. When metrics are off this is a shared do-nothing context manager
+    """
+    if not registry.enabled:
+        return NO_TIMER
+    return Timer(name)
+
+
+def count(name, amount=1):
+    if registry.enabled:
+        registry.count(name, amount)
+
+
+def observe(name, seconds):
+    """
+    Records a duration measured by the caller
+    """
+    if registry.enabled:
+        registry.observe(name, seconds * 1000)
+
+
+def configure(enabled=None, profiling=None, tracing=None, reset=False):
+    """
+    Switches metrics, profiling and memory tracing on or off at runtime;
+    arguments left as None are unchanged. Profiling times sections, so it
+    switches metrics on too
+    """
+    if enabled is not None:
+        registry.enabled = bool(enabled)
+    if profiling is not None:
+        registry.profiling = bool(profiling)
+        registry.enabled = registry.enabled or registry.profiling
+    if tracing and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACE_FRAMES)
+    elif tracing is not None and not tracing and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    if reset:
+        registry.reset()
+
+
+def handle_stats(data):
+    """
+    Applies the switches in a stats request ("metrics", "profile",
+    "trace_memory" and "reset") and returns the report
+    """
+    configure(data.get("metrics"), data.get("profile"), data.get("trace_memory"), bool(data.get("reset")))
+    return registry.report()
+
+
+def format_report(report):
+    """
+    Returns the lines of a readable summary of a report
+    """
+    lines = [f"{'timer':<36}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+    for name, timer in report["timers"].items():
+        lines.append(f"{name:<36}{timer['count']:>8}{timer['mean_ms']:>10.2f}{timer['p50_ms']:>10.2f}"
+                     f"{timer['p99_ms']:>10.2f}{timer['max_ms']:>10.2f}")
+    lines.extend(f"{name}: {value}" for name, value in report["counters"].items())
+    for entry in report.get("profile", []):
+        lines.append(f"{entry['cumulative_ms']:>10.1f} ms {entry['calls']:>8} calls  {entry['function']}")
+    if "memory" in report:
+        memory = report["memory"]
+        lines.append(f"memory: {memory['current_bytes']:,} bytes traced, {memory['peak_bytes']:,} at peak")
+        lines.extend(f"{entry['bytes']:>12,} bytes  {entry['location']}" for entry in memory["top"])
+    return lines
@@ -0,0 +1,395 @@
+# Shortest paths, distances and reachability over a world's zone graph
+
+import os
+import sys
+import time
+import pickle
+import heapq
+from array import array
+from collections import deque
+from world import WORLD_FILE, SNAPSHOT_VERSION, DIRECTIONS, NO_EXIT, load_snapshot, compile_world, \
+    snapshot_is_fresh, source_fingerprint
+
+PATHS_SUFFIX = '.paths'             # Precomputed tables of a world file sit next to it
+PATHS_VERSION = 1
+LANDMARKS = 8                       # Zones whose distance tables bound every other distance (ALT)
+ALT_TIGHTNESS = 2                   # A* is used when the lower bound is within this factor of the upper
+ACTIVE_LANDMARKS = 2                # Landmarks A* consults per query, those giving the best bound at its start
+ALL_PAIRS_LIMIT = 1024              # Worlds up to this many zones get an exact table of every distance
+UNREACHABLE = -1
+
+
+class ZoneGraph:
+    """
+    Directed graph of a World's zones, worked on by row (a zone's position
+    in the world's exit table) and translated to zone ids at the edges.
+
+    Precomputed once per world and cacheable next to the world file:
+    forward and backward distances from a few landmark zones, which give
+    A* an admissible heuristic (ALT) and bound any distance in O(1), weakly
+    connected components, and for small worlds an exact distance table
+    answering distance() in O(1) and path() without search.
+    """
+    def __init__(self, world, tables=None):
+        self.world = world
+        self._ids = array('i', world.rows)  # row -> zone id, rows being numbered in insertion order
+        if tables is None:
+            self._exits = array('i', (NO_EXIT if target == NO_EXIT else world.rows[target] for target in world.exits))
+            self._build_reverse()
+            tables = self.precompute()
+        self._exits = tables["exits"]       # The world's exit table, holding rows instead of zone ids
+        self._reverse_starts = tables["reverse_starts"]
+        self._reverse = tables["reverse"]
+        self._landmarks = tables["landmarks"]
+        self._forward = tables["forward"]
+        self._backward = tables["backward"]
+        self._components = tables["components"]
+        self._all_pairs = tables["all_pairs"]
+
+    def _build_reverse(self):
+        """
+        Stores the zones leading into each zone, packed into one array with an offset per zone
+        """
+        count = len(self._ids)
+        starts = array('i', [0]) * (count + 1)
+        for target in self._exits:
+            if target != NO_EXIT:
+                starts[target + 1] += 1
+        for row in range(count):
+            starts[row + 1] += starts[row]
+        sources = array('i', [0]) * starts[count]
+        filled = array('i', starts[:count])
+        width = len(DIRECTIONS)
+        for index, target in enumerate(self._exits):
+            if target != NO_EXIT:
+                sources[filled[target]] = index // width
+                filled[target] += 1
+        self._reverse_starts = starts
+        self._reverse = sources
+
+    def successors(self, row):
+        start = row * len(DIRECTIONS)
+        return [target for target in self._exits[start:start + len(DIRECTIONS)] if target != NO_EXIT]
+
+    def predecessors(self, row):
+        return self._reverse[self._reverse_starts[row]:self._reverse_starts[row + 1]]
+
+    def distances_from(self, row, backward=False):
+        """
+        Returns the number of moves from row to every zone, or from every zone
+        to row if backward is set, UNREACHABLE where there is no route
+        """
+        neighbours = self.predecessors if backward else self.successors
+        distances = array('i', [UNREACHABLE]) * len(self._ids)
+        distances[row] = 0
+        queue = deque([row])
+        while queue:
+            current = queue.popleft()
+            step = distances[current] + 1
+            for neighbour in neighbours(current):
+                if distances[neighbour] == UNREACHABLE:
+                    distances[neighbour] = step
+                    queue.append(neighbour)
+        return distances
+
+    def precompute(self):
+        """
+        Returns the landmark, component and (for small worlds) all-pairs tables
+        """
+        count = len(self._ids)
+        landmarks = array('i')
+        forward, backward = [], []
+        nearest = array('i', [UNREACHABLE]) * count        # Distance to the closest landmark chosen so far
+        candidate = 0
+        while count and len(landmarks) < LANDMARKS:         # Farthest-first: each landmark far from the others
+            landmarks.append(candidate)
+            forward.append(self.distances_from(candidate))
+            backward.append(self.distances_from(candidate, backward=True))
+            for row, distance in enumerate(forward[-1]):
+                if distance != UNREACHABLE and (nearest[row] == UNREACHABLE or distance < nearest[row]):
+                    nearest[row] = distance
+            candidate = max(range(count), key=nearest.__getitem__)
+            if nearest[candidate] <= 0:                     # Only landmarks and unreached zones are left
+                unreached = [row for row in range(count) if nearest[row] == UNREACHABLE]
+                if not unreached:
+                    break
+                candidate = unreached[0]
+        all_pairs = None
+        if count <= ALL_PAIRS_LIMIT:
+            all_pairs = array('i')
+            for row in range(count):
+                all_pairs.extend(self.distances_from(row))
+        return {"exits": self._exits, "reverse_starts": self._reverse_starts, "reverse": self._reverse,
+                "landmarks": landmarks, "forward": forward, "backward": backward,
+                "components": self._weak_components(), "all_pairs": all_pairs}
+
+    def _weak_components(self):
+        """
+        Returns the component number of every zone, zones being connected if
+        an exit leads either way between them
+        """
+        components = array('i', [UNREACHABLE]) * len(self._ids)
+        component = 0
+        for root in range(len(self._ids)):
+            if components[root] != UNREACHABLE:
+                continue
+            components[root] = component
+            stack = [root]
+            while stack:
+                current = stack.pop()
+                for neighbour in self.successors(current) + list(self.predecessors(current)):
+                    if components[neighbour] == UNREACHABLE:
+                        components[neighbour] = component
+                        stack.append(neighbour)
+            component += 1
+        return components
+
+    def tables(self):
+        return {"exits": self._exits, "reverse_starts": self._reverse_starts, "reverse": self._reverse,
+                "landmarks": self._landmarks, "forward": self._forward, "backward": self._backward,
+                "components": self._components, "all_pairs": self._all_pairs}
+
+    def lower_bound(self, source, target, landmarks=None):
+        """
+        Returns a lower bound on the moves from row source to row target, from
+        the tables of the given landmarks (indexes into the landmark list) or all of them
+        """
+        bound = 0
+        tables = zip(self._forward, self._backward) if landmarks is None else \
+            [(self._forward[landmark], self._backward[landmark]) for landmark in landmarks]
+        for forward, backward in tables:
+            to_target, to_source = forward[target], forward[source]
+            if to_target != UNREACHABLE and to_source != UNREACHABLE:
+                bound = max(bound, to_target - to_source)
+            from_source, from_target = backward[source], backward[target]
+            if from_source != UNREACHABLE and from_target != UNREACHABLE:
+                bound = max(bound, from_source - from_target)
+        return bound
+
+    def distance_bounds(self, source_id, target_id):
+        """
+        Returns (lower, upper) bounds on the moves between two zones in O(1),
+        upper being None when no landmark route is known
+        """
+        source, target = self.world.rows[source_id], self.world.rows[target_id]
+        upper = None
+        for forward, backward in zip(self._forward, self._backward):
+            if backward[source] != UNREACHABLE and forward[target] != UNREACHABLE:
+                through = backward[source] + forward[target]
+                upper = through if upper is None else min(upper, through)
+        return self.lower_bound(source, target), upper
+
+    def distance(self, source_id, target_id):
+        """
+        Returns the fewest moves from one zone to another, or None if there is no route
+        """
+        source, target = self.world.rows[source_id], self.world.rows[target_id]
+        if self._all_pairs is not None:
+            distance = self._all_pairs[source * len(self._ids) + target]
+            return None if distance == UNREACHABLE else distance
+        route = self._route(source, target)
+        return None if route is None else len(route)
+
+    def path(self, source_id, target_id):
+        """
+        Returns the shortest route between two zones as (direction, zone id)
+        steps, [] when they are the same zone, or None if there is no route
+        """
+        source, target = self.world.rows[source_id], self.world.rows[target_id]
+        if self._components[source] != self._components[target]:
+            return None
+        if self._all_pairs is not None:
+            route = self._follow_table(source, target)
+        else:
+            route = self._route(source, target)
+        if route is None:
+            return None
+        width = len(DIRECTIONS)
+        return [(DIRECTIONS[slot], self._ids[self._exits[row * width + slot]]) for row, slot in route]
+
+    def _route(self, source, target):
+        """
+        Searches for a route between rows. A* pays off where the landmark
+        bounds are tight, as on maps laid out like a grid; elsewhere, as in
+        densely linked worlds, meeting in the middle explores far fewer zones
+        """
+        lower = self.lower_bound(source, target)
+        _, upper = self.distance_bounds(self._ids[source], self._ids[target])
+        if upper is not None and lower * ALT_TIGHTNESS >= upper:
+            return self._search(source, target)
+        return self._meet(source, target)
+
+    def _follow_table(self, source, target):
+        """
+        Walks the all-pairs table, taking at each zone an exit one move closer to target
+        """
+        count, width = len(self._ids), len(DIRECTIONS)
+        remaining = self._all_pairs[source * count + target]
+        if remaining == UNREACHABLE:
+            return None
+        route = []
+        current = source
+        while current != target:
+            for slot in range(width):
+                neighbour = self._exits[current * width + slot]
+                if neighbour != NO_EXIT and self._all_pairs[neighbour * count + target] == remaining - 1:
+                    route.append((current, slot))
+                    current = neighbour
+                    remaining -= 1
+                    break
+        return route
+
+    def _search(self, source, target):
+        """
+        A* from row source to row target with the landmark heuristic. Returns
+        the route as (row, exit slot) steps, or None
+        """
+        width = len(DIRECTIONS)
+        landmarks = sorted(range(len(self._landmarks)), reverse=True,        # The few that bound this query best
+                           key=lambda landmark: self.lower_bound(source, target, (landmark,)))[:ACTIVE_LANDMARKS]
+        moves = {source: 0}
+        came_from = {}
+        frontier = [(self.lower_bound(source, target, landmarks), 0, source)]
+        while frontier:
+            _, cost, current = heapq.heappop(frontier)
+            cost = -cost
+            if current == target:
+                route = []
+                while current != source:
+                    current, slot = came_from[current]
+                    route.append((current, slot))
+                route.reverse()
+                return route
+            if cost > moves[current]:                   # Stale entry, a shorter route was found since
+                continue
+            for slot in range(width):
+                neighbour = self._exits[current * width + slot]
+                if neighbour == NO_EXIT or moves.get(neighbour, cost + 2) <= cost + 1:
+                    continue
+                moves[neighbour] = cost + 1
+                came_from[neighbour] = (current, slot)
+                estimate = cost + 1 + self.lower_bound(neighbour, target, landmarks)
+                heapq.heappush(frontier, (estimate, -cost - 1, neighbour))    # Ties go to the deepest zone
+        return None
+
+    def _meet(self, source, target):
+        """
+        Bidirectional BFS from row source and back from row target, expanding
+        the smaller frontier each round. Returns the route as (row, exit slot)
+        steps, or None
+        """
+        if source == target:
+            return []
+        width = len(DIRECTIONS)
+        forward = {source: None}            # row -> (previous row, exit slot) on the way from source
+        backward = {target: None}           # row -> (next row, exit slot) on the way to target
+        forward_frontier, backward_frontier = [source], [target]
+        meeting = None
+        while forward_frontier and backward_frontier and meeting is None:
+            if len(forward_frontier) <= len(backward_frontier):
+                reached = []
+                for current in forward_frontier:
+                    for slot in range(width):
+                        neighbour = self._exits[current * width + slot]
+                        if neighbour == NO_EXIT or neighbour in forward:
+                            continue
+                        forward[neighbour] = (current, slot)
+                        reached.append(neighbour)
+                        if neighbour in backward:
+                            meeting = neighbour
+                forward_frontier = reached
+            else:
+                reached = []
+                for current in backward_frontier:
+                    for previous in self.predecessors(current):
+                        if previous in backward:
+                            continue
+                        slot = self._exits[previous * width:(previous + 1) * width].index(current)
+                        backward[previous] = (current, slot)
+                        reached.append(previous)
+                        if previous in forward:
+                            meeting = previous
+                backward_frontier = reached
+        if meeting is None:
+            return None
+        route = []
+        current = meeting
+        while forward[current] is not None:
+            current, slot = forward[current]
+            route.append((current, slot))
+        route.reverse()
+        current = meeting
+        while backward[current] is not None:
+            following, slot = backward[current]
+            route.append((current, slot))
+            current = following
+        return route
+
+    def components(self):
+        """
+        Returns the ids of the zones in each connected component, largest first
+        """
+        groups = {}
+        for row, component in enumerate(self._components):
+            groups.setdefault(component, []).append(self._ids[row])
+        return sorted(groups.values(), key=len, reverse=True)
+
+    def dead_ends(self):
+        """
+        Returns the ids of zones connected to just one other zone
+        """
+        return [self._ids[row] for row in range(len(self._ids))
+                if len(set(self.successors(row)) | set(self.predecessors(row))) == 1]
+
+    def traps(self):
+        """
+        Returns the ids of zones that can be entered but have no way out
+        """
+        return [self._ids[row] for row in range(len(self._ids))
+                if not self.successors(row) and len(self.predecessors(row))]
+
+
+def load_graph(world, path=None):
+    """
+    Returns the graph of a world, reusing the precomputed tables cached next
+    to its world file when the file has not changed, and caching them otherwise
+    """
+    if path is None:
+        return ZoneGraph(world)
+    try:
+        with open(path + PATHS_SUFFIX, 'rb') as infile:
+            header = pickle.load(infile)
+            if header.get("paths_version") == PATHS_VERSION and snapshot_is_fresh(header, path):
+                return ZoneGraph(world, pickle.load(infile))
+    except (OSError, EOFError, pickle.UnpicklingError, KeyError):
+        pass
+    fingerprint = source_fingerprint(path)
+    graph = ZoneGraph(world)
+    try:
+        write_tables(graph, path, fingerprint)
+    except OSError as error:        # Pathfinding still works, it is just precomputed again next time
+        print(f'Could not cache the path tables: {error}')
+    return graph
+
+
+def write_tables(graph, path, fingerprint):
+    """
+    Caches a graph's precomputed tables next to its world file, under the same header as a snapshot
+    """
+    header = {"version": SNAPSHOT_VERSION, "paths_version": PATHS_VERSION, **fingerprint}
+    temp_path = path + PATHS_SUFFIX + '.tmp'
+    with open(temp_path, 'wb') as outfile:
+        pickle.dump(header, outfile, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(graph.tables(), outfile, pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path + PATHS_SUFFIX)
+
+
+if __name__ == "__main__":
+    for world_path in sys.argv[1:] or [WORLD_FILE]:
+        loaded = load_snapshot(world_path) or compile_world(world_path)
+        started = time.perf_counter()
+        zone_graph = load_graph(loaded, world_path)
+        components = zone_graph.components()
+        print(f'{world_path}: {len(loaded.zones)} zones, {len(components)} components '
+              f'(largest {len(components[0]) if components else 0}), {len(zone_graph.dead_ends())} dead ends, '
+              f'{len(zone_graph.traps())} traps; tables ready in {(time.perf_counter() - started) * 1000:.0f} ms')
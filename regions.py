@@ -0,0 +1,296 @@
+# Paged world file: zones stored in regions that are loaded as the player nears them
+
+import os
+import sys
+import time
+import zlib
+import pickle
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import Mapping
+from world import WORLD_FILE, SNAPSHOT_VERSION, DIRECTIONS, NO_EXIT, SNAPSHOT_TABLES, Zone, World, ObjectTable, \
+    compile_world, load_snapshot, snapshot_is_fresh, source_fingerprint
+
+REGIONS_SUFFIX = '.regions'         # The paged file of a world file sits next to it
+REGION_SIZE = 256                   # Zones per region
+REGION_BUDGET = 16                  # Regions kept in memory unless the region_budget setting says otherwise
+NAMES_PER_BUCKET = 64               # Zone names per bucket of the on-disk name index
+PAGED_ZONE_COUNT = 50000            # Worlds with at least this many zones are played paged
+
+
+def name_bucket(name, buckets):
+    """
+    Returns the name index bucket of a zone name. Names are bucketed
+    ignoring case, so lookups ignoring case read a single bucket
+    """
+    return zlib.crc32(name.lower().encode()) % buckets
+
+
+def partition(world):
+    """
+    Returns the region of every row, grouping zones in the order a
+    breadth-first walk along exits (taken either way) reaches them, so a
+    region holds zones near each other
+    """
+    count = len(world.rows)
+    width = len(DIRECTIONS)
+    neighbours = [[] for _ in range(count)]
+    for index, target in enumerate(world.exits):
+        if target != NO_EXIT:
+            row, target_row = index // width, world.rows[target]
+            neighbours[row].append(target_row)
+            neighbours[target_row].append(row)
+    region_of = array('i', [-1]) * count
+    placed = 0
+    for root in range(count):
+        if region_of[root] != -1:
+            continue
+        region_of[root] = placed // REGION_SIZE
+        placed += 1
+        queue = [root]
+        for current in queue:
+            for neighbour in neighbours[current]:
+                if region_of[neighbour] == -1:
+                    region_of[neighbour] = placed // REGION_SIZE
+                    placed += 1
+                    queue.append(neighbour)
+    return region_of
+
+
+class RowIndex(Mapping):
+    """
+    Zone id to row, from two sorted arrays instead of a dictionary. Iterates
+    ids in row order, like the dictionary of a fully loaded World
+    """
+    def __init__(self, ids, sorted_ids, sorted_rows):
+        self._ids = ids                     # row -> id
+        self._sorted_ids = sorted_ids       # Every id in order, and its row
+        self._sorted_rows = sorted_rows
+
+    @staticmethod
+    def sort(ids):
+        """
+        Returns the sorted ids and their rows, given the id of every row
+        """
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+        return array('i', (ids[row] for row in order)), array('i', order)
+
+    def __getitem__(self, zone_id):
+        if not isinstance(zone_id, int):
+            raise KeyError(zone_id)
+        position = bisect_left(self._sorted_ids, zone_id)
+        if position == len(self._sorted_ids) or self._sorted_ids[position] != zone_id:
+            raise KeyError(zone_id)
+        return self._sorted_rows[position]
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class RegionFile:
+    """
+    Reader for a paged world file: a snapshot-style header pickle, an
+    index pickle (row arrays, exits, the offset tables, quests, NPCs and
+    settings), then one pickle per region and per name bucket at the
+    recorded offsets
+    """
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self.header = pickle.load(self._file)
+        self.index = None
+        self._base = None
+        self._lock = threading.Lock()
+
+    def read_index(self):
+        self.index = pickle.load(self._file)
+        self._base = self._file.tell()
+        return self.index
+
+    def read(self, offsets, number):
+        """
+        Returns the pickled region or name bucket at position number of an offset table
+        """
+        with self._lock:
+            self._file.seek(self._base + offsets[number])
+            return pickle.loads(self._file.read(offsets[number + 1] - offsets[number]))
+
+    def close(self):
+        self._file.close()
+
+
+class NameIndex(Mapping):
+    """
+    Zone name to id, read from the name buckets of a paged world file as needed
+    """
+    def __init__(self, region_file):
+        self._file = region_file
+        self._offsets = region_file.index["bucket_offsets"]
+        self._buckets = len(self._offsets) - 1
+
+    def _bucket(self, name):
+        return self._file.read(self._offsets, name_bucket(name, self._buckets))
+
+    def __getitem__(self, name):
+        for zone_name, zone_id in self._bucket(name):
+            if zone_name == name:
+                return zone_id
+        raise KeyError(name)
+
+    def find(self, name):
+        """
+        Returns the id of a zone by name ignoring case, or None
+        """
+        folded = name.lower()
+        for zone_name, zone_id in self._bucket(name):
+            if zone_name.lower() == folded:
+                return zone_id
+        return None
+
+    def __iter__(self):
+        for number in range(self._buckets):
+            for zone_name, _ in self._file.read(self._offsets, number):
+                yield zone_name
+
+    def __len__(self):
+        return self._file.index["count"]
+
+
+class RegionTable(Mapping):
+    """
+    Zone id to Zone over a paged world file. The region holding a zone is
+    read on first access, and the least recently used regions are dropped
+    once more than budget are in memory, so memory follows the player's
+    neighbourhood rather than the size of the world. Safe to use from
+    several threads
+    """
+    def __init__(self, region_file, rows, budget=REGION_BUDGET):
+        self._file = region_file
+        self._rows = rows
+        self._region_of = region_file.index["region_of"]
+        self._offsets = region_file.index["region_offsets"]
+        self._resident = OrderedDict()          # region -> {row: Zone}, least recently used first
+        self._budget = budget
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def set_budget(self, budget):
+        with self._lock:
+            self._budget = max(1, budget)
+            self._evict()
+
+    def _evict(self):
+        while len(self._resident) > self._budget:
+            self._resident.popitem(last=False)
+
+    def region(self, region):
+        """
+        Returns the zones of a region by row, reading it if it is not in memory
+        """
+        with self._lock:
+            zones = self._resident.get(region)
+            if zones is not None:
+                self._resident.move_to_end(region)
+                return zones
+        rows = self._file.read(self._offsets, region)
+        zones = {row: Zone(dict(zip(Zone.FIELDS, values))) for row, values in rows.items()}
+        with self._lock:
+            self._resident[region] = zones
+            self._resident.move_to_end(region)
+            self.loads += 1
+            self._evict()
+        return zones
+
+    def resident(self):
+        """
+        Returns the regions in memory, least recently used first
+        """
+        with self._lock:
+            return list(self._resident)
+
+    def __getitem__(self, zone_id):
+        row = self._rows[zone_id]
+        return self.region(self._region_of[row])[row]
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, zone_id):
+        return zone_id in self._rows
+
+
+def load_regions(path=WORLD_FILE, budget=REGION_BUDGET):
+    """
+    Returns the world paged from the regions file of the world file at
+    path, or None if there is none or the world file has changed since
+    """
+    try:
+        region_file = RegionFile(path + REGIONS_SUFFIX)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    try:
+        if not snapshot_is_fresh(region_file.header, path):
+            region_file.close()
+            return None
+        index = region_file.read_index()
+    except (OSError, EOFError, pickle.UnpicklingError, KeyError):
+        region_file.close()
+        return None
+    rows = RowIndex(index["ids"], index["sorted_ids"], index["sorted_rows"])
+    quests, npcs = (ObjectTable(SNAPSHOT_TABLES[name], *index[name]) for name in ("quests", "npcs"))
+    return World(RegionTable(region_file, rows, budget), quests, npcs, index["settings"], NameIndex(region_file),
+                 rows, index["exits"])
+
+
+def write_regions(world, path=WORLD_FILE, fingerprint=None):
+    """
+    Writes the paged file of a world built from the world file at path
+    """
+    header = {"version": SNAPSHOT_VERSION, **(fingerprint or source_fingerprint(path))}
+    ids = array('i', world.rows)
+    region_of = partition(world)
+    regions = [{} for _ in range(max(region_of, default=-1) + 1)]
+    for row, zone_id in enumerate(ids):
+        data = world.zones[zone_id].to_data()
+        regions[region_of[row]][row] = tuple(data[field] for field in Zone.FIELDS)
+    buckets = [[] for _ in range(max(1, len(ids) // NAMES_PER_BUCKET))]
+    for name, zone_id in world.zone_ids.items():
+        buckets[name_bucket(name, len(buckets))].append((name, zone_id))
+    blobs = [pickle.dumps(region, pickle.HIGHEST_PROTOCOL) for region in regions]
+    region_offsets = array('q', [0])
+    for blob in blobs:
+        region_offsets.append(region_offsets[-1] + len(blob))
+    bucket_blobs = [pickle.dumps(bucket, pickle.HIGHEST_PROTOCOL) for bucket in buckets]
+    bucket_offsets = array('q', [region_offsets[-1]])
+    for blob in bucket_blobs:
+        bucket_offsets.append(bucket_offsets[-1] + len(blob))
+    sorted_ids, sorted_rows = RowIndex.sort(ids)
+    index = {"count": len(ids), "ids": ids, "sorted_ids": sorted_ids, "sorted_rows": sorted_rows,
+             "exits": world.exits, "region_of": region_of,
+             "region_offsets": region_offsets, "bucket_offsets": bucket_offsets, "settings": world.settings}
+    for name in ("quests", "npcs"):
+        index[name] = ObjectTable.from_objects(SNAPSHOT_TABLES[name], getattr(world, name))
+    temp_path = path + REGIONS_SUFFIX + '.tmp'
+    with open(temp_path, 'wb') as outfile:
+        pickle.dump(header, outfile, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(index, outfile, pickle.HIGHEST_PROTOCOL)
+        for blob in blobs + bucket_blobs:
+            outfile.write(blob)
+    os.replace(temp_path, path + REGIONS_SUFFIX)
+
+
+if __name__ == "__main__":
+    for world_path in sys.argv[1:] or [WORLD_FILE]:
+        started = time.perf_counter()
+        source = source_fingerprint(world_path)
+        full = load_snapshot(world_path) or compile_world(world_path)
+        write_regions(full, world_path, source)
+        print(f'Paged {world_path}: {len(full.zones)} zones in {-(-len(full.zones) // REGION_SIZE)} regions '
+              f'in {(time.perf_counter() - started) * 1000:.0f} ms')
@@ -1,47 +1,419 @@
 # Autosave microservice
 
-import time
-import zmq
+import os
+import re
 import json
+import time
+import hashlib
+import threading
+from urllib.parse import quote
+import save_format
+import metrics
+from service import serve, worker_count
+
+SAVE_WORKERS = 4
+SAVE_REQUESTS = ("save", "load", "list", "stats", "delete", "copy")
+SAVE_GENERATIONS = 3    # Copies kept per slot: the current save and the ones before it
+SAVE_ENCODING = "compact"   # How slots are written: "compact" binary (see save_format), or "json" text
+
+SAVE_DIR = "saves"          # One directory of slot files per player, plus the catalog
+CATALOG_FILE = "catalog.log"
+DEFAULT_PLAYER = "default"  # Owner of saves from clients that do not name a player
+MAX_SLOT_NAME = 64
+MAX_PLAYER_NAME = 64
+LEGACY_SLOT_FILE = re.compile(r"save_slot_(.+)\.json$")     # Numbered slots from before the catalog
+
+_slot_locks = {}
+_slot_locks_lock = threading.Lock()
+
+
+def slot_lock(player, slot):
+    """
+    Returns the lock serializing access to one save slot
+    """
+    with _slot_locks_lock:
+        return _slot_locks.setdefault((player, slot), threading.Lock())
+
+
+def generation_path(player, slot, generation=0):
+    """
+    Returns the file of a slot's save, 0 being the newest
+    """
+    path = os.path.join(SAVE_DIR, quote(player, safe=""), quote(slot, safe="") + ".sav")
+    return path if generation == 0 else f'{path}.{generation}'
+
+
+def encode_slot(data):
+    """
+    Returns slot file contents: a header line with a checksum of the save, then the save as JSON
+    """
+    body = json.dumps(data)
+    header = {"checksum": hashlib.sha256(body.encode()).hexdigest(), "saved_at": time.time()}
+    return json.dumps(header) + "\n" + body
+
+
+def decode_slot(content):
+    """
+    Returns the save held in slot file contents, or raises ValueError if it
+    is damaged. Files written before checksums were added are plain JSON
+    """
+    if save_format.is_compact(content):
+        return save_format.decode(content)
+    content = content.decode() if isinstance(content, bytes) else content
+    header_line, _, body = content.partition("\n")
+    try:
+        header = json.loads(header_line)
+    except ValueError:
+        return json.loads(content)
+    if hashlib.sha256(body.encode()).hexdigest() != header["checksum"]:
+        raise ValueError("Checksum mismatch")
+    return json.loads(body)
 
-context = zmq.Context()             # Sets up the environment so that we are able to begin
-socket = context.socket(zmq.REP)    # Reply socket type
-socket.bind("tcp://*:5556")         # Set to listen on port 5556
+
+def save_location(data):
+    """
+    Returns the player location recorded in a save, if it has one
+    """
+    player = data.get("player") if isinstance(data, dict) else None
+    return player.get("location") if isinstance(player, dict) else None
 
 
-def save_game_data(slot, data):
+def fsync_directory(path):
     """
-    Saves game state
+    Forces renames in a directory to disk
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_generation(player, slot, content):
     """
-    with open(f'save_slot_{slot}.json', "w") as file:
-        json.dump(data["data"], file, indent=4)
+    Makes content the newest generation of a slot. It is written to a
+    temporary file and synced, older generations are shifted down, and the
+    new file is renamed into place, so at every moment at least one complete
+    generation is on disk. Callers hold the slot lock
+    """
+    path = generation_path(player, slot)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(content)
+        file.flush()
+        os.fsync(file.fileno())
+    for generation in range(SAVE_GENERATIONS - 1, 0, -1):
+        if os.path.exists(generation_path(player, slot, generation - 1)):
+            os.replace(generation_path(player, slot, generation - 1), generation_path(player, slot, generation))
+    os.replace(temp_path, path)
+    fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+class SaveCatalog:
+    """
+    Index of every save, keyed by player and slot name, holding what a
+    listing shows (time saved, player location, size and checksum) so slot
+    files are only opened to load them.
+
+    The catalog lives in memory and is persisted as an append-only log, one
+    JSON entry per save or deletion, compacted once it grows past twice the
+    number of saves. It is shared by every worker thread and guarded by an
+    internal lock.
+    """
+    def __init__(self, directory=SAVE_DIR):
+        self._directory = directory
+        self._path = os.path.join(directory, CATALOG_FILE)
+        self._entries = {}          # player -> {slot: entry}
+        self._count = 0
+        self._log_entries = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Loads the catalog, moving numbered save_slot files into it on first run
+        """
+        self._entries = {}
+        self._count = 0
+        self._log_entries = 0
+        if not os.path.exists(self._path):
+            os.makedirs(self._directory, exist_ok=True)
+            self.import_legacy_slots()
+            return
+        with open(self._path, "r") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:      # Torn final line from a crash mid-append
+                    continue
+                self._log_entries += 1
+                slots = self._entries.setdefault(entry["player"], {})
+                if entry.get("deleted"):
+                    self._count -= slots.pop(entry["slot"], None) is not None
+                else:
+                    self._count += entry["slot"] not in slots
+                    slots[entry["slot"]] = entry
+
+    def import_legacy_slots(self, directory="."):
+        """
+        Copies the newest intact generation of each save_slot_N.json into the
+        default player's slot N, which every player sees in their listing
+        until they have a slot of the same name. The old files are left
+        where they are
+        """
+        for filename in sorted(os.listdir(directory)):
+            match = LEGACY_SLOT_FILE.match(filename)
+            if match is None:
+                continue
+            for suffix in [""] + [f".{generation}" for generation in range(1, SAVE_GENERATIONS)]:
+                try:
+                    with open(os.path.join(directory, filename + suffix), "rb") as file:
+                        data = decode_slot(file.read())
+                except (OSError, ValueError, KeyError):
+                    continue
+                save_game_data(DEFAULT_PLAYER, match.group(1), {"data": data})
+                print(f'Imported {filename} as slot {match.group(1)}, which every player can load')
+                break
+
+    def get(self, player, slot):
+        with self._lock:
+            return self._entries.get(player, {}).get(slot)
+
+    def list(self, player):
+        """
+        Returns a player's catalog entries, newest first, along with the
+        default player's saves (such as imported legacy slots) that the
+        player has no slot of the same name for
+        """
+        with self._lock:
+            own = self._entries.get(player, {})
+            shared = self._entries.get(DEFAULT_PLAYER, {}) if player != DEFAULT_PLAYER else {}
+            entries = list(own.values()) + [entry for slot, entry in shared.items() if slot not in own]
+        return sorted(entries, key=lambda entry: entry["saved_at"], reverse=True)
+
+    def owner(self, player, slot):
+        """
+        Returns whose save a player means by a slot name: their own, or the
+        default player's if they have none of that name
+        """
+        if self.get(player, slot) is None and self.get(DEFAULT_PLAYER, slot) is not None:
+            return DEFAULT_PLAYER
+        return player
+
+    def record(self, entry):
+        """
+        Adds or replaces the entry for a save, or removes it for a deletion entry
+        """
+        with self._lock:
+            slots = self._entries.setdefault(entry["player"], {})
+            if entry.get("deleted"):
+                self._count -= slots.pop(entry["slot"], None) is not None
+            else:
+                self._count += entry["slot"] not in slots
+                slots[entry["slot"]] = entry
+            if self._log_entries + 1 > 2 * self._count + 1:
+                self._compact()
+            else:
+                with open(self._path, "a") as file:
+                    file.write(json.dumps(entry) + "\n")
+                    file.flush()
+                    os.fsync(file.fileno())
+                self._log_entries += 1
+
+    def _compact(self):
+        """
+        Rewrites the log with one entry per save. Callers hold the lock
+        """
+        content = "".join(json.dumps(entry) + "\n" for slots in self._entries.values() for entry in slots.values())
+        temp_path = self._path + ".tmp"
+        with open(temp_path, "w") as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self._path)
+        self._log_entries = self._count
+
+
+catalog = SaveCatalog()
 
+
+def slot_content(data, blob=None):
+    """
+    Returns the bytes to write for a save, given either as decoded data or
+    as a compact blob from the client. A compact blob is stored as it is
+    """
+    if blob is not None:
+        save_format.verify(blob)
+        if SAVE_ENCODING == "compact":
+            return bytes(blob)
+        data = save_format.decode(blob)
+    if SAVE_ENCODING == "compact":
+        return save_format.encode(data)
+    return encode_slot(data).encode()
+
+
+def catalog_entry(player, slot, content, location):
+    return {"player": player, "slot": slot, "saved_at": time.time(), "location": location,
+            "size": len(content), "checksum": hashlib.sha256(content).hexdigest()}
+
+
+def save_game_data(player, slot, data, blob=None):
+    """
+    Saves game state to a slot and records it in the catalog
+    """
+    content = slot_content(data.get("data"), blob)
+    location = data.get("location") or save_location(data.get("data"))
+    with slot_lock(player, slot):
+        write_generation(player, slot, content)
+        catalog.record(catalog_entry(player, slot, content, location))
+    metrics.count("save.bytes_written", len(content))
     return True
 
-def load_game_data(slot):
+
+def read_slot(content, compact):
     """
-    Sends back load data
+    Returns an intact slot's save as a compact blob if compact is set, or as decoded data
     """
-    with open(f'save_slot_{slot}.json', "r") as file:
-        load_data = json.load(file)
-    return load_data
+    if not compact:
+        return decode_slot(content)
+    if save_format.is_compact(content):
+        save_format.verify(content)
+        return content
+    return save_format.encode(decode_slot(content))
 
 
-while True:
-    data = socket.recv_json()  # Where the message will be held
-    response = None
+def load_game_data(player, slot, compact=False):
+    """
+    Sends back load data from the newest generation of the slot that is intact,
+    as a compact blob if the client asked for one
+    """
+    if catalog.get(player, slot) is None:
+        return {"error": f"There is no save named {slot}"}
+    with slot_lock(player, slot):
+        for generation in range(SAVE_GENERATIONS):
+            try:
+                with open(generation_path(player, slot, generation), "rb") as file:
+                    return read_slot(file.read(), compact)
+            except (OSError, ValueError, KeyError):
+                continue
+    return {"error": "No intact save in this slot"}
 
-    if data:
-        if data['request'] == 'save':
-            print('Save request received')
-            response = save_game_data(data['slot'], data)
-            socket.send_string(str(response))
-            print('Save successful')
 
-        if data['request'] == 'load':
-            print('Load request received')
-            response = load_game_data(data['slot'])
+def delete_save(player, slot):
+    """
+    Removes a slot and all its generations
+    """
+    with slot_lock(player, slot):
+        if catalog.get(player, slot) is None:
+            return {"error": f"There is no save named {slot}"}
+        catalog.record({"player": player, "slot": slot, "deleted": True})
+        for generation in range(SAVE_GENERATIONS):
+            try:
+                os.remove(generation_path(player, slot, generation))
+            except FileNotFoundError:
+                pass
+    return True
+
+
+def copy_save(player, slot, new_slot, new_player=None):
+    """
+    Copies the newest intact generation of a slot into another slot, of
+    the same player unless new_player is given
+    """
+    new_player = player if new_player is None else new_player
+    if (player, slot) == (new_player, new_slot):
+        return {"error": "A save cannot be copied onto itself"}
+    entry = catalog.get(player, slot)
+    if entry is None:
+        return {"error": f"There is no save named {slot}"}
+    blob = load_game_data(player, slot, compact=True)
+    if isinstance(blob, dict):
+        return blob
+    return save_game_data(new_player, new_slot, {"location": entry["location"]}, blob)
+
+
+def check_slot_name(slot):
+    """
+    Returns an error message if slot is not a usable slot name, else None
+    """
+    if not isinstance(slot, str) or not slot.strip():
+        return "Save names cannot be empty"
+    if len(slot) > MAX_SLOT_NAME:
+        return f"Save names can be at most {MAX_SLOT_NAME} characters"
+    return None
+
+
+def check_player_name(player):
+    """
+    Returns an error message if player is not a usable player name, else
+    None. Player names are directory names, so "." and ".." are refused
+    """
+    if not player.strip() or player in (".", ".."):
+        return "Invalid player name"
+    if len(player) > MAX_PLAYER_NAME:
+        return f"Player names can be at most {MAX_PLAYER_NAME} characters"
+    return None
+
+
+def handle_request(socket, data, blob=None):
+    """
+    Replies to one request. Saves, deletions and copies are answered with
+    "True", loads with the save (a compact save as [metadata, blob]),
+    listings with the player's catalog entries, stats with the service's
+    metrics, and failures with an error
+    """
+    request = data.get('request')
+    player = str(data.get('player') or DEFAULT_PLAYER)
+    slot = data.get('slot')
+    if isinstance(slot, int):       # Numbered slots from older clients
+        slot = str(slot)
+    if request in ('load', 'copy') and isinstance(slot, str):     # Shared saves can be read but not deleted
+        source = catalog.owner(player, slot)
+    else:
+        source = player
+    error = None if request == 'stats' else check_player_name(player)
+    if request not in ('list', 'stats') and error is None:
+        error = check_slot_name(slot)
+    if request == 'copy' and error is None:
+        error = check_slot_name(data.get('new_slot'))
+    if error is not None:
+        socket.send_json({"error": error})
+
+    elif request == 'save':
+        print('Save request received')
+        response = save_game_data(player, slot, data, blob and blob.buffer)
+        socket.send_string(str(response))
+        print('Save successful')
+
+    elif request == 'load':
+        print('Load request received')
+        response = load_game_data(source, slot, data.get('encoding') == 'compact')
+        if isinstance(response, bytes):
+            socket.send_multipart([json.dumps({"encoding": "compact"}).encode(), response], copy=False)
+        else:
+            socket.send_json(response)
+        print('Data successful sent')
+
+    elif request == 'list':
+        socket.send_json({"saves": catalog.list(player)})
+
+    elif request == 'stats':
+        socket.send_json({"metrics": metrics.handle_stats(data)})
+
+    elif request in ('delete', 'copy'):
+        if request == 'delete':
+            response = delete_save(player, slot)
+        else:
+            response = copy_save(source, slot, data['new_slot'], player)
+        if response is True:
+            socket.send_string(str(response))
+        else:
             socket.send_json(response)
-            print('Data successful sent')
 
-        time.sleep(2)
+    else:
+        socket.send_json({"error": "Unknown request"})
+
+
+if __name__ == "__main__":
+    catalog.load()
+    serve("tcp://*:5556", handle_request, worker_count(SAVE_WORKERS), requests=SAVE_REQUESTS)      # Set to listen on port 5556
@@ -0,0 +1,71 @@
+# Compact binary encoding for saves, shared by the game and the save microservice
+
+import json
+import zlib
+import struct
+
+try:
+    import msgpack          # Optional: faster and smaller than JSON when installed
+except ImportError:
+    msgpack = None
+
+MAGIC = b"RPGS"
+VERSION = 1
+CODEC_JSON = 1              # zlib-compressed JSON
+CODEC_MSGPACK = 2           # zlib-compressed msgpack
+HEADER = struct.Struct("<4sBBI")    # magic, version, codec, CRC-32 of the compressed payload
+COMPRESSION_LEVEL = 1           # zlib level: the fastest, and still several times smaller than JSON
+
+
+def is_compact(blob):
+    """
+    Returns whether blob starts with the compact save header
+    """
+    return bytes(blob[:len(MAGIC)]) == MAGIC
+
+
+def encode(data, codec=None):
+    """
+    Returns data as a compact save: a versioned header, then the save
+    serialized with msgpack (or JSON without it) and compressed with zlib
+    """
+    if codec is None:
+        codec = CODEC_MSGPACK if msgpack is not None else CODEC_JSON
+    if codec == CODEC_MSGPACK:
+        body = msgpack.packb(data)
+    else:
+        body = json.dumps(data, separators=(",", ":")).encode()
+    payload = zlib.compress(body, COMPRESSION_LEVEL)
+    return HEADER.pack(MAGIC, VERSION, codec, zlib.crc32(payload)) + payload
+
+
+def verify(blob):
+    """
+    Raises ValueError unless blob is a compact save whose checksum matches,
+    without decompressing it
+    """
+    if len(blob) < HEADER.size:
+        raise ValueError("Save is truncated")
+    magic, version, codec, checksum = HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError("Not a compact save")
+    if version > VERSION:
+        raise ValueError(f"Save format version {version} is newer than this game")
+    if zlib.crc32(memoryview(blob)[HEADER.size:]) != checksum:
+        raise ValueError("Checksum mismatch")
+    return codec
+
+
+def decode(blob):
+    """
+    Returns the save held in a compact blob, or raises ValueError if it is damaged
+    """
+    codec = verify(blob)
+    body = zlib.decompress(memoryview(blob)[HEADER.size:])
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise ValueError("Save needs the msgpack package to load")
+        return msgpack.unpackb(body, strict_map_key=False)
+    if codec == CODEC_JSON:
+        return json.loads(body)
+    raise ValueError(f"Unknown save codec {codec}")
@@ -0,0 +1,86 @@
+# Worker pool shared by the microservices
+
+import sys
+import json
+import threading
+import zmq
+import metrics
+
+WORKER_COUNT = 4        # Worker threads per service, unless given on the command line
+QUEUE_DEPTH = 16        # Requests queued per worker before the service stops accepting more
+
+
+def worker_count(default=WORKER_COUNT):
+    """
+    Returns the worker count given as the first command line argument, or the default
+    """
+    if len(sys.argv) > 1:
+        return max(1, int(sys.argv[1]))
+    return default
+
+
+def request_timer(data, requests=()):
+    """
+    Returns the timer name of a request: its request or command if that is
+    one of requests, "asset" for plain asset requests, and "unknown" for
+    anything else, so clients cannot add timers at will
+    """
+    kind = data.get("request") or data.get("command")
+    if kind is None:
+        return "request.asset"
+    return f"request.{kind}" if isinstance(kind, str) and kind in requests else "request.unknown"
+
+
+def work(context, address, handle, requests=()):
+    """
+    Worker thread: answers requests handed out by the proxy until the context is terminated
+    """
+    socket = context.socket(zmq.REP)
+    socket.setsockopt(zmq.RCVHWM, QUEUE_DEPTH)
+    socket.connect(address)
+    while True:
+        try:
+            frames = socket.recv_multipart(copy=False)
+        except zmq.ContextTerminated:
+            break
+        try:
+            data = json.loads(frames[0].bytes)
+            with metrics.timed(request_timer(data, requests)):
+                handle(socket, data, *frames[1:])
+        except Exception as error:      # Reply so the client is not left waiting
+            print(f'Request failed: {error!r}')
+            socket.send_json({"error": str(error)})
+    socket.close()
+
+
+def serve(address, handle, workers=WORKER_COUNT, context=None, requests=()):
+    """
+    Binds a ROUTER socket on address and proxies requests to a pool of
+    worker threads. handle(socket, data, *attachments) runs in a worker with
+    its REP socket, the decoded JSON request and any further frames sent
+    with it (as zmq.Frame objects), and sends exactly one reply. Requests
+    are timed by name when their request or command is one of requests.
+
+    Requests queue at most QUEUE_DEPTH deep per worker. Once every worker's
+    queue is full the proxy stops reading from clients, whose sends then wait
+    at their own high-water mark, so a busy service slows clients down
+    instead of dropping or buffering without bound. Blocks until the context
+    is terminated or the process is interrupted.
+    """
+    context = context or zmq.Context.instance()
+    frontend = context.socket(zmq.ROUTER)           # Accepts many client connections at once
+    frontend.setsockopt(zmq.RCVHWM, workers * QUEUE_DEPTH)
+    frontend.bind(address)
+    backend = context.socket(zmq.DEALER)            # Hands requests to the worker pool
+    backend.setsockopt(zmq.SNDHWM, QUEUE_DEPTH)
+    backend_address = f"inproc://workers-{id(backend)}"
+    backend.bind(backend_address)
+    for _ in range(workers):
+        threading.Thread(target=work, args=(context, backend_address, handle, requests), daemon=True).start()
+    try:
+        zmq.proxy(frontend, backend)
+    except zmq.ContextTerminated:
+        pass
+    finally:
+        frontend.close(linger=0)
+        backend.close(linger=0)
@@ -0,0 +1,104 @@
+# Tests of the character service, run against a store in a temporary directory
+#
+#   python -m unittest test_character
+
+import os
+import tempfile
+import unittest
+
+import character
+
+
+class TransactionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.saved_store = character.store
+        character.store = character.CharacterStore(os.path.join(self.directory.name, "characters"))
+        character.store.load()
+        character.store.add(character.new_character("Alice", "Warrior"))
+        self.session = character.Session("Alice")
+
+    def tearDown(self):
+        character.store = self.saved_store
+        self.directory.cleanup()
+
+    def batch(self, *commands):
+        return character.handle_batch(self.session, {"transaction": True, "commands": list(commands)})
+
+    def test_error_rolls_back(self):
+        response = self.batch({"command": "add_experience", "exp_points": 500},
+                              {"command": "add_experience", "exp_points": -1})
+        self.assertEqual(response["status"], "error")
+        self.assertEqual(character.store.get("Alice")["experience"], 0)
+
+    def test_exception_rolls_back_changes(self):
+        response = self.batch({"command": "add_experience", "exp_points": 500},
+                              {"command": "add_experience", "exp_points": "abc"})
+        self.assertEqual(response["status"], "error")
+        self.assertEqual(character.store.get("Alice")["experience"], 0)
+
+    def test_exception_rolls_back_creation(self):
+        response = self.batch({"command": "create_new_character", "name": "Bob", "job": "Rogue"},
+                              {"command": "set_active_character", "name": "Bob"},
+                              {"command": "add_experience", "exp_points": None})
+        self.assertEqual(response["status"], "error")
+        self.assertIsNone(character.store.get("Bob"))
+        self.assertEqual(self.session.active, "Alice")
+
+    def test_commit(self):
+        response = self.batch({"command": "add_experience", "exp_points": 500})
+        self.assertEqual(response["status"], "success")
+        self.assertEqual(character.store.get("Alice")["experience"], 500)
+
+
+class StoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "characters")
+        self.store = character.CharacterStore(self.path)
+        self.store.load()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def reload(self):
+        store = character.CharacterStore(self.path)
+        store.load()
+        return store
+
+    def test_compaction_skips_unflushed_characters(self):
+        self.store.add(character.new_character("Alice", "Warrior"))
+        self.store.flush()
+        self.store.add(character.new_character("Bob", "Rogue"))
+        self.store.compact_index()
+        store = self.reload()
+        self.assertIsNotNone(store.get("Alice"))
+        self.assertIsNone(store.get("Bob"))
+        self.assertNotIn("Bob", store.list(prefix="b")["names"])
+
+    def test_missing_record_is_absent(self):
+        self.store.add(character.new_character("Alice", "Warrior"))
+        self.store.flush()
+        os.remove(self.store.record_path("alice"))
+        self.assertIsNone(self.reload().get("Alice"))
+
+
+class SessionTest(unittest.TestCase):
+    def test_idle_session_expires(self):
+        token = character.open_session()
+        character.get_session(token).last_used -= character.SESSION_IDLE_TIMEOUT + 1
+        self.assertIsNone(character.get_session(token))
+        self.assertNotIn(token, character._sessions)
+
+    def test_use_keeps_session(self):
+        token = character.open_session()
+        self.assertIs(character.get_session(token), character.get_session(token))
+        character.close_session(token)
+
+    def test_default_session_never_expires(self):
+        character.get_session(None).last_used -= character.SESSION_IDLE_TIMEOUT + 1
+        self.assertIsNotNone(character.get_session(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
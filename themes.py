@@ -1,30 +1,41 @@
+# Theme microservice
 
-import time
-import zmq
-import base64
+import metrics
+from asset_cache import AssetCache, send_asset, send_chunk
+from service import serve, worker_count
 
-context = zmq.Context()             # Sets up the environment so that we are able to begin
-socket = context.socket(zmq.REP)    # Reply socket type
-socket.bind("tcp://*:5557")         # Set to listen on port 5557
+THEME_CACHE_BUDGET = 64 * 1024 * 1024   # Bytes of theme audio kept in memory
+MAX_CHUNK_SIZE = 1024 * 1024            # Largest chunk served to streaming clients
+THEME_WORKERS = 4
+THEME_REQUESTS = ("stats", "chunk")     # Requests other than plain theme fetches
 
+cache = AssetCache(THEME_CACHE_BUDGET)
 
-def retrieve_sound(theme):
+
+def theme_path(theme):
+    """
+    Returns the file path of a theme
+    """
+    return 'themes/' + theme + '.mp3'
+
+
+def handle_request(socket, data):
     """
-    Retrieves image and returns as byte string
+    Replies to one request with a theme, a chunk of one, or the cache counters and metrics
     """
-    sound = open('themes/' + theme + '.mp3', 'rb').read()
-    byte_sounds = base64.b64encode(sound)
-    return byte_sounds
+    if data.get('request') == 'stats':
+        socket.send_json({**cache.stats(), "metrics": metrics.handle_stats(data)})
+        return
 
+    if data.get('request') == 'chunk':    # Streaming clients pace themselves by chunk requests
+        size = min(int(data['size']), MAX_CHUNK_SIZE)
+        send_chunk(socket, cache, (data['theme'],), theme_path(data['theme']), int(data['offset']), size)
+        return
 
-while True:
-    data = socket.recv_json()  # Where the message will be held
-    response = None
+    print('Request received')
+    send_asset(socket, cache, (data['theme'],), theme_path(data['theme']), data.get('encoding'))
+    print('Sound file delivered')
 
-    if data:
-        print('Request received')
-        response = retrieve_sound(data['theme'])
-        socket.send(response)
-        print('Sound file delivered')
 
-        time.sleep(1)
\ No newline at end of file
+if __name__ == "__main__":
+    serve("tcp://*:5557", handle_request, worker_count(THEME_WORKERS), requests=THEME_REQUESTS)     # Set to listen on port 5557
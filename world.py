@@ -0,0 +1,400 @@
+# World model: zones, quests, NPCs and the player, and the precompiled world snapshot
+
+import os
+import sys
+import json
+import time
+import pickle
+import hashlib
+from array import array
+from collections.abc import Mapping
+
+WORLD_FILE = 'game_data.json'
+SNAPSHOT_SUFFIX = '.snapshot'       # The snapshot of a world file sits next to it
+SNAPSHOT_VERSION = 2                # Bump when the model classes change shape
+HASH_BLOCK_SIZE = 1024 * 1024
+
+START_ZONE = "Town"                 # Where a new player starts
+DIRECTIONS = ("north", "south", "east", "west")
+DIRECTION_SLOTS = {direction: slot for slot, direction in enumerate(DIRECTIONS)}
+NO_EXIT = -1                        # Exit table entry for a direction that leads nowhere
+
+
+class Zone:
+    __slots__ = ("_object_num", "_zone_name", "_lore", "_npcs", "_items", "_theme")
+    FIELDS = ("object_num", "zone_name", "zone_lore", "npcs", "items", "theme")
+
+    def __init__(self, data):
+        self._object_num = data["object_num"]
+        self._zone_name = data["zone_name"]
+        self._lore = data["zone_lore"]
+        self._npcs = data["npcs"]
+        self._items = data["items"]
+        self._theme = data["theme"]
+
+    def get_id(self):
+        return self._object_num
+
+    def get_npcs(self):
+        return self._npcs
+
+    def get_items(self):
+        return self._items
+
+    def get_lore(self):
+        return self._lore
+
+    def get_name(self):
+        return self._zone_name
+
+    def to_data(self):
+        """
+        Returns the zone in the game_data.json layout, without its exits, which the World holds
+        """
+        return {"object_num": self._object_num, "zone_name": self._zone_name, "zone_lore": self._lore,
+                "npcs": self._npcs, "items": self._items, "theme": self._theme}
+
+
+class Player:
+    __slots__ = ("name", "score", "location")
+
+    def __init__(self):
+        self.name = "Player"
+        self.score = 0
+        self.location = None        # Id of the zone the player is in, set once a world is loaded
+
+    def change_name(self, name):
+        self.name = name
+
+    def move(self, zone_id):
+        self.location = zone_id
+
+    def change_score(self, points):
+        self.score += points
+
+
+class Quest:
+    __slots__ = ("_object_num", "_quest_name", "_progress", "_complete", "_quest_text")
+    FIELDS = ("object_num", "quest_name", "quest_progress", "quest_complete", "quest_text")
+
+    def __init__(self, data):
+        self._object_num = data["object_num"]
+        self._quest_name = data["quest_name"]
+        self._progress = data["quest_progress"]
+        self._complete = data["quest_complete"]
+        self._quest_text = data["quest_text"]
+
+    def state(self):
+        """
+        Returns the fields that change during play, as stored in saves
+        """
+        return {"quest_progress": self._progress, "quest_complete": self._complete}
+
+    def saveable(self, data):
+        return {"quest_progress": data["quest_progress"], "quest_complete": data["quest_complete"]}
+
+    def restore(self, state):
+        self._progress = state["quest_progress"]
+        self._complete = state["quest_complete"]
+
+    def to_data(self):
+        return {"object_num": self._object_num, "quest_name": self._quest_name, "quest_progress": self._progress,
+                "quest_complete": self._complete, "quest_text": self._quest_text}
+
+
+class NPC:
+    __slots__ = ("_object_num", "_npc_name", "_hostile", "_stats", "_alive", "_reputation", "_dialogue")
+    FIELDS = ("object_num", "npc_name", "hostile", "stats", "alive", "reputation", "dialogue")
+
+    def __init__(self, data):
+        self._object_num = data["object_num"]
+        self._npc_name = data["npc_name"]
+        self._hostile = data["hostile"]
+        self._stats = data["stats"]
+        self._alive = data["alive"]
+        self._reputation = data["reputation"]
+        self._dialogue = data["dialogue"]
+
+    def state(self):
+        """
+        Returns the fields that change during play, as stored in saves
+        """
+        return {"alive": self._alive, "reputation": self._reputation}
+
+    def saveable(self, data):
+        return {"alive": data["alive"], "reputation": data["reputation"]}
+
+    def restore(self, state):
+        self._alive = state["alive"]
+        self._reputation = state["reputation"]
+
+    def to_data(self):
+        return {"object_num": self._object_num, "npc_name": self._npc_name, "hostile": self._hostile,
+                "stats": self._stats, "alive": self._alive, "reputation": self._reputation, "dialogue": self._dialogue}
+
+
+class ObjectTable(Mapping):
+    """
+    Read-only mapping of key (a zone id, or a quest or NPC name) to model
+    object over the columns of a snapshot. Objects are built on first access and kept, so loading a
+    snapshot does not pay for objects the game never touches
+    """
+    def __init__(self, cls, index, columns):
+        self._cls = cls
+        self._index = index             # key -> row
+        self._columns = columns         # One list per field in cls.FIELDS
+        self._built = {}
+
+    @classmethod
+    def from_objects(cls, model, objects):
+        """
+        Returns the index and columns holding a dictionary of key to object
+        """
+        rows = [[data[field] for field in model.FIELDS] for data in (obj.to_data() for obj in objects.values())]
+        columns = [list(column) for column in zip(*rows)] if rows else [[] for _ in model.FIELDS]
+        return {key: row for row, key in enumerate(objects)}, columns
+
+    def __getitem__(self, key):
+        obj = self._built.get(key)
+        if obj is None:
+            row = self._index[key]
+            obj = self._cls({field: column[row] for field, column in zip(self._cls.FIELDS, self._columns)})
+            self._built[key] = obj
+        return obj
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+
+class World:
+    """
+    The zones, quests, NPCs and settings of a loaded world.
+
+    Zones are addressed by id, their object_num. Their exits live in one
+    flat array('i') with a slot per direction for each zone, holding the
+    neighbour's id or NO_EXIT, so moving is array indexing. Zone names are
+    only mapped to ids at the edges: saves, commands and display
+    """
+    __slots__ = ("zones", "quests", "npcs", "settings", "zone_ids", "rows", "exits", "_folded_names")
+
+    def __init__(self, zones, quests, npcs, settings, zone_ids, rows, exits):
+        self.zones = zones              # id -> Zone
+        self.quests = quests            # name -> Quest
+        self.npcs = npcs                # name -> NPC
+        self.settings = settings
+        self.zone_ids = zone_ids        # name -> id
+        self.rows = rows                # id -> row of the zone's exits
+        self.exits = exits
+        self._folded_names = None
+
+    def find_zone(self, name):
+        """
+        Returns the id of a zone by name, ignoring case, or None
+        """
+        zone_id = self.zone_ids.get(name)
+        if zone_id is not None:
+            return zone_id
+        if not isinstance(self.zone_ids, dict):     # A paged world's on-disk index looks it up itself
+            return self.zone_ids.find(name)
+        if self._folded_names is None:
+            self._folded_names = {zone_name.lower(): zone_id for zone_name, zone_id in self.zone_ids.items()}
+        return self._folded_names.get(name.lower())
+
+    def exit(self, zone_id, direction):
+        """
+        Returns the id of the zone a direction leads to from a zone, or None
+        """
+        target = self.exits[self.rows[zone_id] * len(DIRECTIONS) + DIRECTION_SLOTS[direction]]
+        return None if target == NO_EXIT else target
+
+    def exits_of(self, zone_id):
+        """
+        Returns (direction, zone id) for each exit of a zone
+        """
+        start = self.rows[zone_id] * len(DIRECTIONS)
+        return [(direction, target) for direction, target in zip(DIRECTIONS, self.exits[start:start + len(DIRECTIONS)])
+                if target != NO_EXIT]
+
+    def zone_data(self, zone_id):
+        """
+        Returns a zone in the game_data.json layout, exits given by name
+        """
+        data = self.zones[zone_id].to_data()
+        for direction in DIRECTIONS:
+            data[direction] = None
+        for direction, target in self.exits_of(zone_id):
+            data[direction] = self.zones[target].get_name()
+        return data
+
+
+def read_world_file(path=WORLD_FILE, timings=None):
+    """
+    Reads and parses the world file, adding the time each step took to timings
+    """
+    started = time.perf_counter()
+    try:
+        with open(path, 'rb') as infile:
+            content = infile.read()
+    except FileNotFoundError:  # Error handling
+        print(f'Could not find file {path}')
+        exit()
+    read = time.perf_counter()
+    data = json.loads(content)
+    if timings is not None:
+        timings["read"] = read - started
+        timings["parse"] = time.perf_counter() - read
+    return data
+
+
+def build_world(data, problems=None):
+    """
+    Builds a World from parsed world data. Exits to unknown zones are closed,
+    so moving cannot fail, and reported in problems
+    """
+    problems = [] if problems is None else problems
+    zones = {}
+    zone_ids = {}
+    for zone_data in data["zone_data"]:
+        zone = Zone(zone_data)
+        zones[zone.get_id()] = zone
+        zone_ids[zone.get_name()] = zone.get_id()
+    if not len(zones) == len(zone_ids) == len(data["zone_data"]):
+        problems.append('zone object numbers or names are not unique')
+    rows = {zone_id: row for row, zone_id in enumerate(zones)}
+    exits = array('i', [NO_EXIT]) * (len(zones) * len(DIRECTIONS))
+    for zone_data in data["zone_data"]:
+        start = rows[zone_data["object_num"]] * len(DIRECTIONS)
+        for slot, direction in enumerate(DIRECTIONS):
+            target = zone_data[direction]
+            if target is None:
+                continue
+            if target not in zone_ids:
+                problems.append(f'{direction} exit of {zone_data["zone_name"]} leads to unknown zone {target}; closed')
+                continue
+            exits[start + slot] = zone_ids[target]
+    quests = {quest_data["quest_name"]: Quest(quest_data) for quest_data in data["quest_data"]}
+    npcs = {npc_data["npc_name"]: NPC(npc_data) for npc_data in data["npc_data"]}
+    return World(zones, quests, npcs, data["settings"], zone_ids, rows, exits)
+
+
+def validate_world(world, start=None):
+    """
+    Checks that zones name NPCs that exist, that object numbers are unique
+    and that the player starts in a zone. Returns the problems found
+    """
+    problems = []
+    for zone in world.zones.values():
+        for npc_name in zone.get_npcs() or ():
+            if npc_name not in world.npcs:
+                problems.append(f'{zone.get_name()} names unknown NPC {npc_name}')
+    object_nums = set(world.zones)
+    objects = list(world.quests.values()) + list(world.npcs.values())
+    object_nums.update(obj._object_num for obj in objects)
+    if len(object_nums) != len(world.zones) + len(objects):
+        problems.append('object numbers are not unique')
+    if start is not None and start not in world.zone_ids:
+        problems.append(f'starting zone {start} does not exist')
+    return problems
+
+
+def source_fingerprint(path):
+    """
+    Returns the size, modification time and SHA-256 of a world file
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    status = os.stat(path)
+    return {"size": status.st_size, "mtime": status.st_mtime_ns, "sha256": digest.hexdigest()}
+
+
+def snapshot_is_fresh(header, path):
+    """
+    Returns whether a snapshot header matches the world file. The file is
+    only hashed when its size matches but its modification time does not
+    """
+    if header.get("version") != SNAPSHOT_VERSION:
+        return False
+    try:
+        status = os.stat(path)
+    except OSError:
+        return False
+    if status.st_size != header["size"]:
+        return False
+    if status.st_mtime_ns == header["mtime"]:
+        return True
+    return source_fingerprint(path)["sha256"] == header["sha256"]
+
+
+SNAPSHOT_TABLES = {"zones": Zone, "quests": Quest, "npcs": NPC}
+
+
+def load_snapshot(path=WORLD_FILE):
+    """
+    Returns the world compiled from the world file at path, or None if there
+    is no snapshot or the world file has changed since it was compiled
+    """
+    try:
+        with open(path + SNAPSHOT_SUFFIX, 'rb') as infile:
+            if not snapshot_is_fresh(pickle.load(infile), path):
+                return None
+            tables = pickle.load(infile)
+    except (OSError, EOFError, pickle.UnpicklingError, KeyError):
+        return None
+    zones, quests, npcs = (ObjectTable(model, *tables[name]) for name, model in SNAPSHOT_TABLES.items())
+    return World(zones, quests, npcs, tables["settings"], tables["zone_ids"], tables["zones"][0], tables["exits"])
+
+
+def write_snapshot(world, path=WORLD_FILE, fingerprint=None):
+    """
+    Compiles a world built from the world file at path into its snapshot:
+    a header pickle identifying the source, then a pickle of the world's
+    tables as plain columns, which unpickle much faster than model objects
+    """
+    header = {"version": SNAPSHOT_VERSION, **(fingerprint or source_fingerprint(path))}
+    tables = {name: ObjectTable.from_objects(model, getattr(world, name)) for name, model in SNAPSHOT_TABLES.items()}
+    tables.update(settings=world.settings, zone_ids=world.zone_ids, exits=world.exits)
+    temp_path = path + SNAPSHOT_SUFFIX + '.tmp'
+    with open(temp_path, 'wb') as outfile:
+        pickle.dump(header, outfile, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(tables, outfile, pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path + SNAPSHOT_SUFFIX)
+
+
+def compile_world(path=WORLD_FILE, timings=None):
+    """
+    Build step: parses and validates a world file and writes its snapshot.
+    Adds the time each step took to timings
+    """
+    timings = {} if timings is None else timings
+    fingerprint = source_fingerprint(path)      # Taken first, so edits made meanwhile leave the snapshot stale
+    data = read_world_file(path, timings)
+    building = time.perf_counter()
+    problems = []
+    world = build_world(data, problems)
+    validating = time.perf_counter()
+    timings["build"] = validating - building
+    for problem in problems + validate_world(world):
+        print(f'World data: {problem}')
+    writing = time.perf_counter()
+    timings["validate"] = writing - validating
+    try:
+        write_snapshot(world, path, fingerprint)
+    except OSError as error:        # The game still runs from the world file
+        print(f'Could not write the world snapshot: {error}')
+    timings["write snapshot"] = time.perf_counter() - writing
+    return world
+
+
+if __name__ == "__main__":
+    for world_path in sys.argv[1:] or [WORLD_FILE]:
+        started = time.perf_counter()
+        compiled = compile_world(world_path)
+        print(f'Compiled {world_path}: {len(compiled.zones)} zones in {(time.perf_counter() - started) * 1000:.0f} ms')
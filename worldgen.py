@@ -0,0 +1,171 @@
+# Seeded generator of large worlds and character rosters, for testing and benchmarks
+
+import os
+import sys
+import json
+import math
+import time
+import zlib
+import random
+from world import START_ZONE
+from character import CharacterStore, INDEX_FILE, JOB_STAT_INCREMENTS, LEVELING, character_summary, new_character
+
+THEMES = ("calm", "epic", "fairy", "nocturnal", "peak", "relaxing", "sorrow", "spooky", "strong")     # Shipped themes
+NPC_CHANCE = 0.1            # Chance of a zone having an NPC
+QUEST_CHANCE = 0.5          # Chance of an NPC giving a quest
+EXTRA_LINK_PERCENT = 35     # Chance that a zone is linked both north and west rather than one of them
+DEFAULT_SETTINGS = {"image_display": True, "theme_sounds": True, "prefetch_depth": 1, "prefetch_budget_mb": 32,
+                    "autosave_interval": 30, "region_budget": 16}
+
+ADJECTIVES = ("Misty", "Ancient", "Quiet", "Broken", "Golden", "Frozen", "Sunken", "Whispering", "Hollow", "Burning",
+              "Verdant", "Forgotten", "Crimson", "Windswept", "Silent", "Gloomy")
+PLACES = ("Forest", "Ruins", "Crossing", "Hills", "Marsh", "Cavern", "Meadow", "Bridge", "Shrine", "Valley", "Outpost",
+          "Lake", "Pass", "Grove", "Tower", "Mill")
+SIGHTS = ("Fog clings to the ground here.", "The wind carries the smell of rain.", "Old stones lie half buried.",
+          "Birds fall silent as you pass.", "A narrow trail winds between the trees.",
+          "Smoke rises somewhere in the distance.", "The ground is soft and wet underfoot.")
+DETAILS = ("You feel you are being watched.", "Someone has camped here recently.", "A faded sign points onward.",
+           "The path ahead looks rarely travelled.", "You hear water running nearby.", "")
+FIRST_NAMES = ("Aldric", "Brenna", "Cedric", "Dara", "Edric", "Fiona", "Gareth", "Hilda", "Ivor", "Jora", "Kael",
+               "Lyra", "Maren", "Nolan", "Orla", "Perrin", "Quinn", "Rowan", "Sabine", "Tamsin")
+TITLES = ("Merchant", "Hermit", "Guard", "Pilgrim", "Hunter", "Smith", "Bard", "Healer")
+QUEST_VERBS = ("Clear", "Explore", "Guard", "Search", "Restore", "Scout")
+
+
+def object_span(zone_count):
+    """
+    Returns the spacing of the object number ranges: zones are numbered from
+    one span, quests from two and NPCs from three, as in game_data.json
+    """
+    return 10 ** max(4, len(str(zone_count)))
+
+
+def links(seed, row, column):
+    """
+    Returns whether the zone at a grid position is linked to the zone north
+    of it and to the zone west of it. The first row is linked all the way
+    along and the first column all the way down, and every other zone is
+    linked at least one of the two ways, so every zone can reach every other
+    """
+    if row == 0:
+        return False, column > 0
+    if column == 0:
+        return True, False
+    value = zlib.crc32(f"{seed}:{row}:{column}".encode())
+    if value % 100 < EXTRA_LINK_PERCENT:
+        return True, True
+    return bool(value & 0x100), not value & 0x100
+
+
+def zone_exits(seed, index, zone_count, width):
+    """
+    Returns the zone index beyond each exit of a zone, or None. Zones are laid
+    out on a grid width zones wide, and every exit has a matching one back
+    """
+    row, column = divmod(index, width)
+    north, west = links(seed, row, column)
+    south = index + width < zone_count and links(seed, row + 1, column)[0]
+    east = column + 1 < width and index + 1 < zone_count and links(seed, row, column + 1)[1]
+    return {"north": index - width if north else None, "south": index + width if south else None,
+            "east": index + 1 if east else None, "west": index - 1 if west else None}
+
+
+def zone_name(rng, index):
+    if index == 0:
+        return START_ZONE
+    return f"{rng.choice(ADJECTIVES)} {rng.choice(PLACES)} {index}"
+
+
+def generate_zones(zone_count, seed, quests, npcs):
+    """
+    Yields the zones of a generated world in game_data.json format, appending
+    the quests and NPCs placed along the way. The same count and seed always
+    give the same world
+    """
+    rng = random.Random(seed)
+    span = object_span(zone_count)
+    width = math.isqrt(zone_count - 1) + 1 if zone_count > 1 else 1
+    names = [zone_name(rng, index) for index in range(zone_count)]
+    for index, name in enumerate(names):
+        zone = {"object_num": span + index, "zone_name": name,
+                "zone_lore": f"{rng.choice(SIGHTS)} {rng.choice(DETAILS)}".strip(), "npcs": None, "items": None,
+                "theme": rng.choice(THEMES)}
+        for direction, target in zone_exits(seed, index, zone_count, width).items():
+            zone[direction] = None if target is None else names[target]
+        if rng.random() < NPC_CHANCE:
+            npc_name = f"{rng.choice(FIRST_NAMES)} the {rng.choice(TITLES)} {len(npcs)}"
+            npcs.append({"object_num": 3 * span + len(npcs), "npc_name": npc_name, "hostile": rng.random() < 0.2,
+                         "stats": None, "alive": True, "reputation": rng.randint(-5, 5), "dialogue": None})
+            zone["npcs"] = [npc_name]
+            if rng.random() < QUEST_CHANCE:
+                quests.append({"quest_name": f"{rng.choice(QUEST_VERBS)} the {name} {len(quests)}",
+                               "object_num": 2 * span + len(quests), "quest_progress": 0, "quest_complete": False,
+                               "quest_text": f"{npc_name} asks for your help in the {name}."})
+        yield zone
+
+
+def generate_world(zone_count, seed=0):
+    """
+    Returns a generated world in the game_data.json layout
+    """
+    quests, npcs = [], []
+    zones = list(generate_zones(zone_count, seed, quests, npcs))
+    return {"zone_data": zones, "quest_data": quests, "npc_data": npcs, "settings": dict(DEFAULT_SETTINGS)}
+
+
+def write_world(path, zone_count, seed=0):
+    """
+    Writes a generated world file one zone at a time, so worlds of millions
+    of zones are written without holding them in memory
+    """
+    quests, npcs = [], []
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as outfile:
+        outfile.write('{"zone_data": [')
+        for number, zone in enumerate(generate_zones(zone_count, seed, quests, npcs)):
+            outfile.write((',\n' if number else '\n') + json.dumps(zone))
+        outfile.write('\n], "quest_data": ' + json.dumps(quests) + ', "npc_data": ' + json.dumps(npcs) +
+                      ', "settings": ' + json.dumps(DEFAULT_SETTINGS) + '}\n')
+    os.replace(temp_path, path)
+
+
+def generate_roster(count, seed=0):
+    """
+    Yields character records with unique names, jobs and levels spread over
+    the leveling curve, most of them low
+    """
+    rng = random.Random(seed)
+    jobs = list(JOB_STAT_INCREMENTS)
+    for number in range(count):
+        character = new_character(f"{rng.choice(FIRST_NAMES)}{number}", rng.choice(jobs))
+        character["experience"] = int(rng.random() ** 3 * LEVELING.cumulative[-1])
+        LEVELING.apply(character)
+        yield character
+
+
+def write_roster(directory, count, seed=0):
+    """
+    Writes a generated roster in the character service's layout: one file
+    per character and a compacted name index
+    """
+    os.makedirs(directory, exist_ok=True)
+    layout = CharacterStore(directory)
+    with open(os.path.join(directory, INDEX_FILE), 'w') as index:
+        for character in generate_roster(count, seed):
+            with open(layout.record_path(character["name"].lower()), 'w') as outfile:
+                outfile.write(json.dumps(character, indent=4))
+            index.write(json.dumps(character_summary(character)) + '\n')
+
+
+if __name__ == "__main__":
+    # python worldgen.py world|roster <count> [seed]
+    kind, count = sys.argv[1], int(sys.argv[2])
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    started = time.perf_counter()
+    if kind == "world":
+        output = f'world_{count}.json'
+        write_world(output, count, seed)
+    else:
+        output = f'characters_{count}'
+        write_roster(output, count, seed)
+    print(f'Wrote {output} in {(time.perf_counter() - started) * 1000:.0f} ms')